@@ -1,6 +1,27 @@
 ######################################################################
-# Import randint and shuffle from random module.
-from random import randint, shuffle
+# Import Random, randint and shuffle from random module, heap
+# operations (for consolidate) from heapq, insort (for automove) from
+# bisect, perf_counter (for searchmove) from time, sqrt (for
+# winProbability) from math, json and TextIOBase (for event logs), sys
+# (for rendering), Pool (for tournaments) from multiprocessing, mmap
+# and Struct (for game records), permutations (for position hashing)
+# and islice (for decks) from itertools, OrderedDict (for the
+# consolidation cache) from collections, and urandom (for seeding
+# streams) from os.
+from random import Random, randint, shuffle
+from heapq import heapify, heappop, heappush
+from bisect import insort
+from time import perf_counter
+from math import sqrt
+import json
+import sys
+from io import TextIOBase
+from multiprocessing import Pool
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from itertools import permutations, islice
+from collections import OrderedDict
+from os import urandom
 
 ######################################################################
 # createDeck() produces a new, cannonically ordered, 52 card deck
@@ -9,13 +30,76 @@ from random import randint, shuffle
 # deck used in many older card games (including tarot cards). Here,
 # we'll use it with default values.
 #
-def createDeck(N=13, S=('spades', 'hearts', 'clubs', 'diamonds')):
+# Passing encoded=True gives the same deck, in the same order, as
+# compact integer cards (see encodeCard() below).
+#
+def createDeck(N=13, S=('spades', 'hearts', 'clubs', 'diamonds'), encoded=False):
+    if encoded:
+        return([ encodeCard((v, s)) for s in S for v in range(1, N+1) ])
     return([ (v, s) for s in S for v in range(1, N+1) ]) 
 
+# A shoe of several decks shuffled together, for large tables (see
+# decksFor()). Duplicate cards are simply equal.
+#
+# Example:
+#   >>> len(createShoe(3))
+#   156
+#
+def createShoe(decks=1, encoded=False):
+    return createDeck(encoded=encoded)*decks
+
+######################################################################
+# Compact integer cards. A card (v, s) can also be packed into a
+# single int 0-51 as 4*(v-1) + SUITS.index(s). Suits are numbered
+# alphabetically, so sorting encoded cards puts them in exactly the
+# same order as sorting the equivalent (v, s) tuples, and the auto
+# player makes the same choices with either representation.
+#
+# Everything the rules need is precomputed into tables indexed by the
+# encoded card: RANK and COLOR (0 black, 1 red), and WANTS, where bit
+# c of WANTS[t] is set if card c can be played on a pile whose top is
+# t. A hand, or any other set of cards, can be held as a 52-bit mask
+# with bit c set for each card c it contains.
+#
+# Example:
+#   >>> encodeCard((12, 'hearts'))
+#   46
+#   >>> decodeCard(46)
+#   (12, 'hearts')
+#   >>> WANTS[encodeCard((2, 'diamonds'))] >> encodeCard((1, 'spades')) & 1
+#   1
+#
+SUITS = ('clubs', 'diamonds', 'hearts', 'spades')
+COLORS = {'clubs':0, 'diamonds':1, 'hearts':1, 'spades':0}
+RANK = [ c//4 + 1 for c in range(52) ]
+COLOR = [ COLORS[SUITS[c%4]] for c in range(52) ]
+WANTS = [ sum(1 << c for c in range(52) if RANK[c] == RANK[t]-1 and COLOR[c] != COLOR[t])
+          for t in range(52) ]
+KING = 48        # Encoded cards >= KING are kings.
+
+# Consolidation keys: HAVE[c] identifies the rank and colour of card
+# c, and NEED[t] the rank and colour a card must have to go on top of
+# t, so legal([t], c) exactly when HAVE[c] == NEED[t].
+HAVE = [ 2*RANK[c] + COLOR[c] for c in range(52) ]
+NEED = [ 2*(RANK[c]-1) + 1-COLOR[c] for c in range(52) ]
+
+def encodeCard(c):
+    return 4*(c[0]-1) + SUITS.index(c[1])
+
+def decodeCard(c):
+    return (RANK[c], SUITS[c%4])
+
+# Returns the 52-bit mask of the encoded cards in H.
+def handMask(H):
+    mask = 0
+    for c in H:
+        mask |= 1 << c
+    return mask
+
 ######################################################################
 # Construct the representation of a given card using special unicode
 # characters for hearts, diamonds, clubs, and spades. The input is a
-# legal card, c, which is a (v, s) tuple. The output is a 2 or
+# legal card, c, which is a (v, s) tuple or an encoded int. The output is a 2 or
 # 3-character string 'vs' or 'vvs', where 's' here is the unicode
 # character corresponding to the four standard suites (spades, hearts,
 # diamonds or clubs -- provided), and v is a 1 or 2 digit string
@@ -27,23 +111,28 @@ def createDeck(N=13, S=('spades', 'hearts', 'clubs', 'diamonds')):
 #    'A♠'
 #    >>> displayCard((12, 'hearts'))
 #    'Q♡'
+#    >>> displayCard(46)
+#    'Q♡'
 #
+SUITSYMBOLS = {'spades':'\u2660', 'hearts':'\u2661', 'diamonds':'\u2662', 'clubs':'\u2663'}
+RANKSYMBOLS = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K"]
+CARDNAMES = [ RANKSYMBOLS[RANK[c]-1] + SUITSYMBOLS[SUITS[c%4]] for c in range(52) ]
+
 def displayCard(c):
-    suits = {'spades':'\u2660', 'hearts':'\u2661', 'diamonds':'\u2662', 'clubs':'\u2663'}
-    
-    #Assigned ranks to a list of all the ranks of cards 
-    ranks = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K"]
-    
-    
+    # Encoded cards are simply looked up.
+    if c.__class__ is int:
+        return CARDNAMES[c]
+
     #assigning v,s where "v" is a rank and "s" is a suit to card representation c
     v,s = c
     
     #returns the rank minus 1 because of the way lists are indexed along with the unicode representation of a suit
-    return ranks[v-1] + suits[s]
+    return RANKSYMBOLS[v-1] + SUITSYMBOLS[s]
 
 ######################################################################
 # Print out an indexed representation of the state of the table:
-# foundation piles are numbered 0-3, corner piles 4-7.
+# foundation piles are numbered 0-3, corner piles 4-7 (on larger
+# tables, foundations come first and corners follow on).
 # Example:
 #   >>> showTable(F, C)
 #     F0: 9♡...9♡
@@ -78,12 +167,13 @@ def showTable(F, C):
         else:
             foundation.append(displayCard(i[0]) + "..." + displayCard(i[-1])) 
     #Giant print statement that is separated by the new line character that essentially sets up the table representation
-    print("\n".join(["F" + str(i) + ": " + foundation[i] for i in range(4)] + ["C" + str(i+4) + ": " + corners[i] for i in range(4)]))
+    print("\n".join(["F" + str(i) + ": " + foundation[i] for i in range(len(F))] + ["C" + str(i+len(F)) + ": " + corners[i] for i in range(len(C))]))
 ######################################################################
 # Print out an indexed list of the cards in input list H, representing
 # a hand. Entries are numbered starting at 8 (indexes 0-3 are reserved
-# for foundation piles, and 4-7 are reserved for corners). The
-# indexing is used to select cards for play.
+# for foundation piles, and 4-7 are reserved for corners), or at start
+# on a table with a different number of piles. The indexing is used to
+# select cards for play, so the hand is sorted (highest first) to match.
 #
 # Example:
 #   >>> showHand(H[0])
@@ -91,10 +181,10 @@ def showTable(F, C):
 #   >>> showHand(H[1])
 #   Hand: 8:9♣ 9:5♢ 10:8♢ 11:9♢ 12:10♡ 13:A♠ 14:4♠
 #
-def showHand(H):
+def showHand(H, start=8):
     
-    #assigning x to a list of values that go from 8 to as many cards as there are in the hand
-    x = [str(num)+ ":" for num in range(8, len(H)+len(H))]    
+    #assigning x to a list of values that go from start to as many cards as there are in the hand
+    x = [str(num)+ ":" for num in range(start, start+len(H))]    
     
     #assigning y to list of values that displayCard(h) puts out in the form of a hand
     H.sort(reverse = True)   #sorts values from highest to lowest
@@ -110,13 +200,384 @@ def showHand(H):
     
     
     
+######################################################################
+# A cached renderer, for showing the same table turn after turn (e.g.,
+# to spectators of many tables). CARDSTRINGS holds the string for each
+# of the 52 cards, in both representations, so a card is drawn with
+# one lookup. A Renderer remembers the first and last card of each
+# pile as it last drew them, along with the line it drew, and only
+# rebuilds a pile's line when one of those changes; the hand's line
+# is likewise rebuilt only when the hand changes. Lines are numbered as
+# by showTable() and showHand() (the hand's from the number of piles),
+# but the hand is not sorted in place.
+#
+# frame() returns a whole frame (an optional header, the table and,
+# if given, a hand) as one string; draw() writes it to file (standard
+# output by default) in a single write.
+#
+# Example:
+#   >>> D, H, F = deal(2, createDeck(encoded=True), Random(5))
+#   >>> C = [ [] for i in range(4) ]
+#   >>> view = Renderer()
+#   >>> view.draw(F, C, H[0], header='Player 0 to move')
+#   Player 0 to move
+#   F0: K♣...K♣
+#   F1: K♡...K♡
+#   F2: 5♡...5♡
+#   F3: 7♡...7♡
+#   C4: 
+#   C5: 
+#   C6: 
+#   C7: 
+#   Hand: 8:Q♠ 9:Q♢ 10:J♢ 11:10♠ 12:10♢ 13:5♢ 14:2♢
+#
+CARDSTRINGS = dict(enumerate(CARDNAMES))
+CARDSTRINGS.update((decodeCard(c), CARDNAMES[c]) for c in range(52))
+
+class Renderer:
+    def __init__(self, file=None):
+        self.file = file
+        self.keys = []            # (first, last) card of each pile, as drawn.
+        self.lines = []           # The line drawn for each pile.
+        self.hand = None          # The hand as drawn, its first number and its line.
+        self.handStart = 8
+        self.handLine = ''
+
+    # Returns the table's lines, redoing only those for changed piles.
+    def table(self, F, C):
+        nF = len(F)
+        if len(self.keys) != nF + len(C):
+            self.keys = [False]*(nF + len(C))
+            self.lines = [ ('F' if p < nF else 'C') + str(p) + ': ' for p in range(nF + len(C)) ]
+        for p in range(nF + len(C)):
+            S = F[p] if p < nF else C[p-nF]
+            key = (S[0], S[-1]) if S else None
+            if key != self.keys[p]:
+                label = ('F' if p < nF else 'C') + str(p) + ': '
+                if key is None:
+                    self.lines[p] = label
+                else:
+                    self.lines[p] = label + CARDSTRINGS[key[0]] + '...' + CARDSTRINGS[key[1]]
+                self.keys[p] = key
+        return self.lines
+
+    # The hand's line, numbered from start.
+    def handText(self, hand, start=8):
+        if hand != self.hand or start != self.handStart:
+            self.hand = list(hand)
+            self.handStart = start
+            cards = sorted(hand, reverse=True)
+            self.handLine = 'Hand: ' + ' '.join(str(start+i) + ':' + CARDSTRINGS[c] for i, c in enumerate(cards))
+        return self.handLine
+
+    def frame(self, F, C, hand=None, header=None):
+        lines = list(self.table(F, C))
+        if header is not None:
+            lines.insert(0, header)
+        if hand is not None:
+            lines.append(self.handText(hand, len(F) + len(C)))
+        return '\n'.join(lines)
+
+    def draw(self, F, C, hand=None, header=None):
+        (self.file or sys.stdout).write(self.frame(F, C, hand, header) + '\n')
+
+######################################################################
+# Event logs. Moves aren't printed directly; instead, each move is
+# reported to a log (or "sink") as a compact (player, src, dst, card)
+# event, where src and dst are pile numbers (foundations first, then
+# corners, as in showTable()) or HAND, and card is the card moved
+# (for a pile, its first card). Each turn starts with a (player, DECK,
+# HAND, card) event for the card drawn, or with card None if the deck
+# is empty; this is also how a log learns whose turn it is.
+#
+# Anything with turn(player, card) and move(src, dst, card) methods
+# can be a log. Functions that make moves take a log argument, and
+# skip reporting altogether if it is None or False, so a silent game
+# pays nothing for logging. The logs provided are:
+#
+#   ConsoleLog  prints each move, as the game always has (CONSOLE).
+#   EventLog    records events in an in-memory ring buffer, and can
+#               flush them in bulk to a JSONL or binary file.
+#   NullLog     ignores everything (NULL); it is false, so functions
+#               given it skip reporting just as for None.
+#   Tee         passes events on to several other logs.
+#
+# Example:
+#   >>> F = [ [(11, 'hearts')], [(6, 'diamonds')], [(12, 'spades')], [(9, 'clubs')] ]
+#   >>> C = [ [(13, 'diamonds')], [], [], [] ]
+#   >>> log = EventLog()
+#   >>> automove(F, C, [(5, 'spades'), (8, 'hearts'), (13, 'clubs')], log)
+#   3
+#   >>> list(log)[:3]
+#   [(0, 0, 2, (11, 'hearts')), (0, 2, 4, (12, 'spades')), (0, 254, 0, (13, 'clubs'))]
+#
+HAND = 254
+DECK = 255
+MAXPILES = HAND//2       # Foundations (and corners) binary events can number.
+
+class NullLog:
+    def __bool__(self):
+        return False
+    def turn(self, player, card=None):
+        pass
+    def move(self, src, dst, card):
+        pass
+
+class ConsoleLog:
+    # piles is the number of foundations, needed to tell foundation
+    # and corner numbers apart.
+    def __init__(self, piles=4):
+        self.piles = piles
+    def turn(self, player, card=None):
+        pass
+    def move(self, src, dst, card):
+        kind = 'F' if dst < self.piles else 'C'
+        if src == HAND:
+            print("Moving {} to {}{}".format(displayCard(card), kind, dst))
+        else:
+            print("Moving F{} to {}{}".format(src, kind, dst))
+
+class Tee:
+    def __init__(self, *logs):
+        self.logs = logs
+    def turn(self, player, card=None):
+        for log in self.logs:
+            log.turn(player, card)
+    def move(self, src, dst, card):
+        for log in self.logs:
+            log.move(src, dst, card)
+
+# EventLog keeps the last size events in a ring buffer. If file is
+# given (an open file, text for JSONL or binary for the binary
+# format), the buffer is flushed to it whenever it fills, so no events
+# are lost; otherwise the oldest events are overwritten. The binary
+# format is 4 bytes per event, player, src, dst and card, with cards
+# encoded (see encodeCard()) and 255 standing for no card; JSONL has
+# one [player, src, dst, card] list per line, with the same encoded
+# cards and null for no card.
+class EventLog:
+    def __init__(self, size=65536, file=None):
+        self.size = size
+        self.file = file
+        self.events = [None]*size
+        self.count = 0        # Events ever recorded.
+        self.flushed = 0      # Events already written to a file.
+        self.player = 0
+
+    def turn(self, player, card=None):
+        self.player = player
+        self.move(DECK, HAND, card)
+
+    def move(self, src, dst, card):
+        self.events[self.count % self.size] = (self.player, src, dst, card)
+        self.count = self.count + 1
+        if self.file is not None and self.count - self.flushed == self.size:
+            self.flush()
+
+    # Iterates over the events still in the buffer, oldest first.
+    def __iter__(self):
+        for i in range(max(self.count - self.size, self.flushed if self.file is not None else 0), self.count):
+            yield self.events[i % self.size]
+
+    # Discards the events in the buffer.
+    def clear(self):
+        self.count = 0
+        self.flushed = 0
+
+    # A log is true even while empty (see NullLog).
+    def __bool__(self):
+        return True
+
+    def __len__(self):
+        return self.count - max(self.count - self.size, self.flushed if self.file is not None else 0)
+
+    # Writes the events recorded since the last flush to file (by
+    # default, the log's own file): as 4-byte binary records if the
+    # file is binary, otherwise as one JSON list per line. Either way
+    # cards are written encoded (see cardCode()), so readEvents() gives
+    # the same events back from both. Raises ValueError, writing
+    # nothing, if a pile number doesn't fit in the binary format.
+    def flush(self, file=None):
+        if file is None:
+            file = self.file
+        if file is None:
+            raise ValueError('EventLog has no file to flush to')
+        start = max(self.count - self.size, self.flushed)
+        events = [ self.events[i % self.size] for i in range(start, self.count) ]
+        if isinstance(file, TextIOBase):
+            file.write(''.join(json.dumps((player, src, dst, None if card is None else cardCode(card))) + '\n'
+                               for player, src, dst, card in events))
+        else:
+            file.write(b''.join(packEvent(e) for e in events))
+        self.flushed = self.count
+
+# Packs an event into its 4-byte binary form. Pile numbers must be
+# below HAND (so at most MAXPILES foundations and as many corners);
+# raises ValueError for one that isn't.
+def packEvent(e):
+    player, src, dst, card = e
+    if dst >= HAND and src != DECK:
+        raise ValueError('pile {} does not fit in a binary event'.format(dst))
+    if card is None:
+        card = 255
+    elif card.__class__ is not int:
+        card = encodeCard(card)
+    return bytes((player, src, dst, card))
+
+# Reads events back from an event file, binary or JSONL, as a list of
+# (player, src, dst, card) tuples with encoded cards (or None).
+def readEvents(file):
+    if isinstance(file, TextIOBase):
+        return [ tuple(json.loads(line)) for line in file if line.strip() ]
+    data = file.read()
+    return [ (data[i], data[i+1], data[i+2], None if data[i+3] == 255 else data[i+3])
+             for i in range(0, len(data) - 3, 4) ]
+
+NULL = NullLog()
+CONSOLE = ConsoleLog()
+
+######################################################################
+# Seeded random number streams. A Stream is a random.Random (so it has
+# shuffle(), randint() and the rest) driven by a PCG32 generator
+# instead of the Mersenne Twister. Its whole state is two 64-bit
+# numbers, so it is cheap to create one per game and it gives the same
+# numbers on every platform and in every process:
+#
+#   Stream(seed, stream)  the generator for a seed; each stream number
+#                         gives a different, independent sequence,
+#                         e.g., one per game or per worker.
+#   jump(n)               skips ahead n outputs in O(log n) steps.
+#
+# Example:
+#   >>> rng = Stream(42, 7)
+#   >>> [ rng.randint(1, 6) for i in range(5) ]
+#   [4, 2, 6, 6, 2]
+#   >>> rng = Stream(42, 7)
+#   >>> rng.jump(3)
+#   >>> [ rng.randint(1, 6) for i in range(2) ]
+#   [6, 2]
+#
+PCGMULT = 6364136223846793005
+
+class Stream(Random):
+    def __init__(self, seed=None, stream=0):
+        self.stream = stream
+        super().__init__(seed)
+
+    def seed(self, seed=None, version=2):
+        if seed is None:
+            seed = int.from_bytes(urandom(8), 'little')
+        elif not isinstance(seed, int):
+            raise TypeError('Stream seeds must be integers')
+        self.inc = (self.stream << 1 | 1) & MASK64
+        self.state = 0
+        self._next()
+        self.state = (self.state + seed) & MASK64
+        self._next()
+        self.gauss_next = None
+
+    def getstate(self):
+        return self.state, self.inc, self.gauss_next
+
+    def setstate(self, state):
+        self.state, self.inc, self.gauss_next = state
+
+    # Advances the generator and returns its next 32-bit output.
+    def _next(self):
+        old = self.state
+        self.state = (old*PCGMULT + self.inc) & MASK64
+        x = ((old >> 18 ^ old) >> 27) & 0xffffffff
+        r = old >> 59
+        return (x >> r | x << (-r & 31)) & 0xffffffff
+
+    def getrandbits(self, k):
+        if k <= 32:
+            return self._next() >> (32 - k)
+        result = 0
+        for shift in range(0, k, 32):
+            result |= self._next() << shift
+        return result & ((1 << k) - 1)
+
+    def random(self):
+        return ((self._next() >> 5)*67108864 + (self._next() >> 6))/9007199254740992
+
+    # Skips n outputs (n calls to _next()): the generator is a linear
+    # congruential one, so n steps compose into one, found by squaring.
+    def jump(self, n):
+        mult, plus = 1, 0
+        m, p = PCGMULT, self.inc
+        while n > 0:
+            if n & 1:
+                mult = mult*m & MASK64
+                plus = (plus*m + p) & MASK64
+            p = (m + 1)*p & MASK64
+            m = m*m & MASK64
+            n = n >> 1
+        self.state = (mult*self.state + plus) & MASK64
+
+######################################################################
+# A deck to draw from: the remaining cards in draw order, plus a
+# cursor, so that draw() is O(1) rather than the O(n) shift of
+# D.pop(0) on a list. len(D), D[i] (counting from the next card),
+# iteration and "if D:" all see just the cards not yet drawn.
+#
+# Example:
+#   >>> D = Deck([12, 40, 7])
+#   >>> D.draw(), len(D), D[0]
+#   (12, 2, 40)
+#
+class Deck:
+    __slots__ = ('cards', 'top')
+
+    def __init__(self, cards=()):
+        self.cards = list(cards)
+        self.top = 0
+
+    def __len__(self):
+        return len(self.cards) - self.top
+
+    def __iter__(self):
+        return islice(self.cards, self.top, None)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.cards[self.top:][i]
+        if i < 0:
+            i = i + len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('deck index out of range')
+        return self.cards[self.top+i]
+
+    def __eq__(self, other):
+        if isinstance(other, Deck):
+            other = other.cards[other.top:]
+        return self.cards[self.top:] == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Deck({})'.format(self.cards[self.top:])
+
+    def draw(self):
+        if self.top >= len(self.cards):
+            raise IndexError('draw from an empty deck')
+        self.top = self.top + 1
+        return self.cards[self.top-1]
+
 ######################################################################
 # We'll use deal(N, D) to set up the game. Given a deck (presumably
 # produced by createDeck()), shuffle it, then deal 7 cards to each of
-# N players, and seed the foundation piles with 4 additional cards.
-# Returns D, H, F, where D is what remains of the deck, H is a list of
-# N 7-card "hands", and F is a list of lists corresponding to the four
-# "seeded" foundation piles.
+# N players, and seed the foundation piles with 4 additional cards
+# (or as many as there are piles, if piles is given).
+# Returns D, H, F, where D is what remains of the deck (as a Deck), H
+# is a list of N 7-card "hands", and F is a list of lists
+# corresponding to the four "seeded" foundation piles. If given, rng
+# (a random.Random, or a Stream) is used for the shuffle instead of
+# the module-level generator.
+#
+# Cards are dealt as if popped from the shuffled deck one at a time,
+# but the positions they come from depend only on N and piles, so
+# they're worked out once (by dealOrder()) and then just looked up.
 # 
 # N --> hands based on number of people playing
 # H --> List of all the hands (list of 2 hands by default)
@@ -134,52 +595,191 @@ def showHand(H):
 #   >>> F[2]
 #   [(11, 'hearts')]
 #
-def deal(N, D):
+HANDSIZE = 7
+DEALORDER = {}
+
+# Returns the positions in a shuffled deck of n cards of each hand's
+# cards, of the foundation cards and of the remaining deck, for deal().
+def dealOrder(N, piles, n=52):
+    if (N, piles, n) not in DEALORDER:
+        D = list(range(n))
+        H = [ [ D.pop(i) for i in range(HANDSIZE) ] for person in range(N) ]
+        F = [ D.pop(i) for i in range(piles) ]
+        DEALORDER[N, piles, n] = (H, F, D)
+    return DEALORDER[N, piles, n]
+
+# Returns the number of decks a shoe needs to deal N hands and seed
+# piles foundations: one deck is enough for up to six players on the
+# usual table, and larger tables get as many more as it takes. Each
+# hand, and then the seeds, are taken from every other card (see
+# dealOrder()), so the last hand reaches HANDSIZE-1 cards past the
+# hands' share of the shoe, and the seeds 2*piles-1 cards past it.
+def decksFor(N, piles=4):
+    cards = HANDSIZE*N + max(HANDSIZE - 1, 2*piles - 1)
+    return -(-cards//52)
+
+def deal(N, D, rng=None, piles=4):
     # Shuffle the deck, then return what's left of it after dealing 7
     # Cards to each player and seeding the foundation piles.
-    shuffle(D)       #Shuffles the deck
-    FoundPile = []   #Cards in foundation piles
-    Hands = []   #List that contains all the hands(that are lists themselves)
-    for n in range(N): #Going through each person playing giving them an empty hand
-        x = []
-        Hands.append(x) 
-    for person in range(N): #Going through each player
-        for i in range(7):
-            Hands[person].append(D.pop(i))   #Popping out a card 7 times into each list that is inside Hands
-    for i in range(4):
-        FoundPile.append([D.pop(i)])         #Dealing a card to each of the four foundation piles 
-    return D, Hands, FoundPile
+    if rng is None:
+        shuffle(D)       #Shuffles the deck
+    else:
+        rng.shuffle(D)
+    H, F, rest = dealOrder(N, piles, len(D))
+    Hands = [ [ D[i] for i in hand ] for hand in H ]   #List that contains all the hands(that are lists themselves)
+    FoundPile = [ [D[i]] for i in F ]                    #Cards in foundation piles
+    return Deck([ D[i] for i in rest ]), Hands, FoundPile
+######################################################################
+# A compact pile, for simulators that keep many tables around. The
+# rules only look at a pile's ends (see legal()), so its first card,
+# last card and length are all a Pile stores: S[0], S[-1], len(S)
+# and S == [] work just as for a list, as do append() and extend().
+# Moving one Pile onto another is O(1), whatever the number of cards,
+# instead of copying them all as list.extend() does.
+#
+# With history=True the cards themselves are kept too, as a linked
+# list of chunks ([cards, next] pairs). Merging links the moved pile's
+# chunks onto the end, so it is still O(1); the moved pile must not be
+# used afterwards (it's replaced by an empty one, S[:0]). Only a Pile
+# with history can be iterated or indexed in the middle.
+#
+# Piles can stand in for lists wherever only the ends of the piles are
+# looked at: autoplay(), simulate(), automove(), autopolicy() and
+# consolidate() take them as they are (see autoplay()'s pile
+# argument). What needs every card on the table -- searchmove(),
+# winProbability() and GameState -- needs lists, or Piles with
+# history.
+#
+# Example:
+#   >>> S = Pile([51, 46])
+#   >>> S.extend(Pile([40, 37, 35]))
+#   >>> S
+#   Pile(51..35, 5)
+#   >>> S[0], S[-1], len(S), legal(S, 30)
+#   (51, 35, 5, True)
+#   >>> T = Pile([50, 45], history=True)
+#   >>> T.extend(Pile([40, 33], history=True))
+#   >>> T
+#   Pile([50, 45, 40, 33])
+#
+class Pile:
+    __slots__ = ('head', 'tail', 'count', 'first', 'last', 'history')
+
+    def __init__(self, cards=(), history=False):
+        self.head = self.tail = None
+        self.count = 0
+        self.first = self.last = None   # First and last chunks, with history.
+        self.history = history
+        for c in cards:
+            self.append(c)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if not self.history:
+            raise TypeError('pile has no history')
+        chunk = self.first
+        while chunk is not None:
+            yield from chunk[0]
+            chunk = chunk[1]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if not range(*i.indices(self.count)):
+                return Pile(history=self.history)
+            return Pile(list(self)[i], self.history)
+        if self.count:
+            if i == 0 or i == -self.count:
+                return self.head
+            if i == -1 or i == self.count-1:
+                return self.tail
+            if self.history and -self.count <= i < self.count:
+                return list(self)[i]
+        raise IndexError('pile index out of range')
+
+    # Piles (and lists) are equal if they have the same length, first
+    # and last card, and, if both have their cards, the same cards.
+    def __eq__(self, other):
+        if other.__class__ is list and not other:
+            return not self.count
+        if not isinstance(other, (Pile, list)):
+            return NotImplemented
+        if self.count != len(other):
+            return False
+        if not self.count:
+            return True
+        if self.history and (not isinstance(other, Pile) or other.history):
+            return list(self) == list(other)
+        return self.head == other[0] and self.tail == other[-1]
+
+    __hash__ = None
+
+    def __repr__(self):
+        if self.history:
+            return 'Pile({})'.format(list(self))
+        if not self.count:
+            return 'Pile()'
+        return 'Pile({}..{}, {})'.format(self.head, self.tail, self.count)
+
+    def append(self, c):
+        if not self.count:
+            self.head = c
+        self.tail = c
+        self.count = self.count + 1
+        if self.history:
+            if self.last is None:
+                self.first = self.last = [[c], None]
+            else:
+                self.last[0].append(c)
+
+    def extend(self, cards):
+        if not isinstance(cards, Pile):
+            for c in cards:
+                self.append(c)
+            return
+        if not cards.count:
+            return
+        if self.history and not cards.history:
+            raise ValueError('pile has no history to add')
+        if not self.count:
+            self.head = cards.head
+        self.tail = cards.tail
+        self.count = self.count + cards.count
+        if self.history:
+            if self.last is None:
+                self.first = cards.first
+            else:
+                self.last[1] = cards.first
+            self.last = cards.last
+
 ######################################################################
 # Returns True if card c can be appended to stack S. To be legal, c
 # must be one less in value than S[-1], and should be of the "other"
 # color (red vs black).
+#
+# So the rules only ever look at the ends of a pile: its last card,
+# for what can go on it, and (for a foundation being moved) its first
+# card; the cards in between never matter. Pile, ConsolidateCache,
+# searchmove(), PositionHash and the batch engine (batch.py) all rely
+# on this, keeping or keying piles by just their first and last card.
 # Example:
 #   >>> legal([(2, 'diamonds')], (1, 'spades'))
 #   True
 #   >>> legal([(2, 'diamonds')], (1, 'hearts'))
 #   False
+#   >>> legal([5], 3)
+#   True
 #
 def legal(S, c):
     if S == []:
         return False 
-    def altcolor(c1,c2):
-        red = ['diamonds', 'hearts'] 
-        black = ['clubs', 'spades']
-        if c1 in red:                     #if the card is red
-            if c2 in black:
-                return True                  #returns "red" if the color of the last card in the stack is red
-        elif c1 in black:
-            if c2 in red:
-                return True
-        else: 
-            return False                  #otherwise, returns black
-    if S[-1][0] == c[0]+1:           #if the rank of the last card in the stack is one more than the inputted card
-        if altcolor(S[-1][1],c[1]) is True:
-            return True
-        else:
-            return False
-    else:
-        return False                
+    t = S[-1]
+    # Encoded cards need just one table lookup.
+    if c.__class__ is int:
+        return WANTS[t] >> c & 1 == 1
+    #the rank of the last card in the stack must be one more than the inputted card, and the colors must differ
+    return t[0] == c[0]+1 and COLORS[t[1]] != COLORS[c[1]]
 ######################################################################
 # Governs game play for N players (2 by default). This function sets
 # up the game variables, D, H, F and C, then chooses the first player
@@ -188,11 +788,16 @@ def legal(S, c):
 #
 # Each turn, the current player draws a card from the deck D, if any
 # remain, and then is free to make as many moves as he/she chooses. 
-def play(N=2):
-    # Set up the game.
-    D, H, F = deal(N, createDeck())
+# Moves are reported to log (printed, by default). piles sets the
+# number of foundations (and of corners); cards come from a shoe of as
+# many decks as the table needs (see decksFor()).
+def play(N=2, log=CONSOLE, piles=4):
+    if log is CONSOLE and piles != 4:
+        log = ConsoleLog(piles)
+    # Set up the game, with a shoe of as many decks as it takes.
+    D, H, F = deal(N, createShoe(decksFor(N, piles)), None, piles)
     
-    C = [ [] for i in range(4) ]   # Corners, initially empty.
+    C = [ [] for i in range(piles) ]   # Corners, initially empty.
 
     # Randomly choose a player to start the game.
     player = randint(0,N-1)
@@ -202,19 +807,31 @@ def play(N=2):
     # termination conditions are realized.
     while True:
         # Draw a card if there are any left in the deck.
+        card = None
+        if PROFILE:
+            start = perf_counter()
         if len(D) > 0:
-            H[player].append(D[0])
-            D.remove(D[0])
+            card = D.draw()
+            H[player].append(card)
+        if PROFILE:
+            PROFILE.add('draw', perf_counter() - start)
+        log.turn(player, card)
         print('\n\nPlayer {} ({} cards) to move.'.format(player, len(H[player])))
         print('Deck has {} cards left.'.format(len(D)))
         # Now show the table.
         showTable(F, C)
 
         # Let the current player have a go.
+        if PROFILE:
+            start = perf_counter()
+            before = len(H[player])
         if player != 0:
-            automove(F, C, H[player])
+            automove(F, C, H[player], log)
         else:
-            usermove(F, C, H[player])
+            usermove(F, C, H[player], log)
+        if PROFILE:
+            PROFILE.add('move', perf_counter() - start)
+            PROFILE.turn(before - len(H[player]))
 
         # Check to see if player is out; if so, end the game.
         if H[player] == []:
@@ -229,38 +846,33 @@ def play(N=2):
                 player = 0
 
 ######################################################################
-# Prompts a user to play their hand.
+# Prompts a user to play their hand, reporting moves to log.
 
-def usermove(F, C, hand):
+def usermove(F, C, hand, log=CONSOLE):
     # valid() is an internal helper function that checks if the index
     # i indicates a valid F, C or hand index.  To be valid, it cannot
-    # be an empty pile or an out-of-range hand index. Remember, 0-3
-    # are foundation piles, 4-7 are corner piles, and 8 and up index
-    # into the hand.
+    # be an out-of-range pile or hand index. Remember, foundation
+    # piles come first (0-3 on the usual table), then corner piles
+    # (4-7), and the rest (8 and up) index into the hand.
+    nP = len(F) + len(C)
     def valid(i): 
         if i == "." or i == "/":
             return True        
-        elif i in range(4):      #foundation pile valid index check
+        elif i in range(nP):     #foundation or corner pile valid index check
             return True
-        elif i in range(4,8):  #corner pile valid index check
-            return True
-        elif i >= 8:           #hand index valid check
-            if len(hand)+7 > i:
-                return True
-            else:
-                return False
+        elif i >= nP:            #hand index valid check
+            return i < nP + len(hand)
         else:
             return False
-    # Ensure the hand is sorted, integrating newly drawn card.
-    sorted(hand) 
 
     # Give some instruction.
     print('Enter your move as "src dst": press "/" to refresh display; "." when done')
 
     # Manage any number of moves.
     while True:           # Until the user quits with a .
-        # Display current hand.
-        showHand(hand)
+        # Display current hand (which also sorts it, integrating the
+        # newly drawn card, so the numbers shown are its indexes).
+        showHand(hand, nP)
         # Read inputs and construct a tuple.
         move = []
         while not move or not valid(move[0]) or not valid(move[1]):
@@ -272,256 +884,1368 @@ def usermove(F, C, hand):
                     return False
                 elif move[0] == '/':
                     showTable(F,C)
-                    showHand(hand)
+                    showHand(hand, nP)
                     move = []
                     continue
             try:
                 move = [int(move[0]), int(move[1])]
-                # Execute the command, which looks like [from, to].
-                # Remember, 0-3 are foundations, 4-7 are corners, 8+
-                # are from your hand.
-                #
-                # What follows here is an if/elif/else statement for
-                # each of the following cases.
-                # Playing a card from your hand to a foundation pile.
-                if move[0] >= 8 and move[1] in range(5) and legal(F[move[1]], hand[move[0]-8]):   
-                    print("Moving {} to F{}".format(displayCard(hand[move[0]]),move[1]))
-                    F[move[1]].append(hand[move[0]-8])
-                    hand.pop(move[0]-8)  
-                # Moving a foundation pile to a foundation pile.
-                elif move[0] <= 3 and move[1] <= 3 and legal(F[move[1]],F[move[0]][0]):  
-                    print("Moving F{} to F{}".format(move[0], move[1]))
-                    F[move[1]].append(F[move[0]])
-                    F[move[0]] = []  
-                    
-                # Playing a card from your hand to a corner pile (K only to empty pile).
-                elif hand[move[0]-8][0] == "13" and move[1] == C[move[1]-4] and C[move[1]-4] == []:
-                    print("Moving {} to C{}".format(displayCard(hand[move[0]]),move[1]))
-                    C[move[1]-4].append(hand[move[0]-8])
-                    hand.pop(hand[move[0]-8]) 
-                    
-                # Moving a foundation pile to a corner pile.
-                elif move[0] <= 3 and move[1] in range(5) and legal(C[move[1]-4], F[move[0]][0]):   
-                    print("Moving {} to {}".format(F[move[0]],C[move[1]])) 
-                    C[move[1]-4].append(F[move[0]])
-                    F[move[0]] = []
-                    
-                # Otherwise, print "Illegal move" warning. 
-                else:
-                    print("Illegal move, try again!") 
-            except:
-                    # Any failure to process ends up here.
+            except (IndexError, ValueError):
+                # Any failure to process ends up here.
                 print('Ill-formed move {}'.format(move))
+                move = []
+        # Execute the command, which looks like [from, to]; makeMove()
+        # checks it's legal, whatever the number of piles.
+        try:
+            makeMove(F, C, hand, move[0], move[1], log)
+        except ValueError as e:
+            # Otherwise, print "Illegal move" warning. 
+            print("Illegal move ({}), try again!".format(e)) 
+
+        # If the hand is empty, return. Otherwise, keep trying.
+        if not hand:
+            return
+
+######################################################################
+# Makes a single move from src to dst, numbered as in usermove():
+# foundations 0.., then corners, then the cards in hand. A hand card
+# can go on a pile it's legal for, on an empty foundation, or (if it's
+# a king) in an empty corner; a foundation can be moved onto a pile
+# its first card is legal for. The move is reported to log. Raises
+# ValueError, leaving everything unchanged, if the move isn't legal.
+#
+# Example:
+#   >>> F = [ [(11, 'hearts')], [(6, 'diamonds')], [(12, 'spades')], [(9, 'clubs')] ]
+#   >>> C = [ [(13, 'diamonds')], [], [], [] ]
+#   >>> makeMove(F, C, [(5, 'spades')], 8, 1)
+#   >>> makeMove(F, C, [(5, 'spades')], 8, 2)
+#   Traceback (most recent call last):
+#     ...
+#   ValueError: 5♠ can't go on F2
+#
+def makeMove(F, C, hand, src, dst, log=None):
+    nF = len(F)
+    nP = nF + len(C)
+    if not 0 <= dst < nP:
+        raise ValueError('there is no pile {}'.format(dst))
+    S = F[dst] if dst < nF else C[dst-nF]
+    name = '{}{}'.format('F' if dst < nF else 'C', dst)
+    if src >= nP:
+        if src - nP >= len(hand):
+            raise ValueError('there is no card {} in your hand'.format(src))
+        card = hand[src-nP]
+        if not (legal(S, card) or (S == [] and (dst < nF or isKing(card)))):
+            raise ValueError("{} can't go on {}".format(displayCard(card), name))
+        if log:
+            log.move(HAND, dst, card)
+        S.append(hand.pop(src-nP))
+    elif 0 <= src < nF:
+        if F[src] == [] or src == dst or not legal(S, F[src][0]):
+            raise ValueError("F{} can't go on {}".format(src, name))
+        if log:
+            log.move(src, dst, F[src][0])
+        S.extend(F[src])
+        F[src] = F[src][:0]
+    else:
+        raise ValueError('only foundations and cards in hand can be moved')
+
+######################################################################
+# Returns True if c is a king, in either card representation.
+def isKing(c):
+    if c.__class__ is int:
+        return c >= KING
+    return c[0] == 13
+
+# Returns the list of cards that could be played on a pile whose last
+# card is t. WANTLIST holds the precomputed answers for encoded cards.
+WANTLIST = [ [ c for c in range(52) if WANTS[t] >> c & 1 ] for t in range(52) ]
+
+def wants(t):
+    if t.__class__ is int:
+        return WANTLIST[t]
+    return [ (t[0]-1, s) for s in SUITS if t[0] > 1 and COLORS[s] != COLORS[t[1]] ]
+
+######################################################################
+# MoveGen is an incremental move generator for playing cards from a
+# hand onto the table. It keeps an index from each "wanted" card (one
+# that can go on the last card of some pile) to the piles that want
+# it, plus the lists of open (empty) foundations and corners. Piles
+# are numbered as on the table: foundations 0.., then corners from
+# len(F) on, corner j being pile len(F)+j.
+#
+# playable(hand) gives every card in hand with a legal move, as one
+# set intersection; target(c) picks the pile the auto player would
+# use for c; play(c, p) puts c on pile p and updates the index, which
+# touches only that pile. A MoveGen is also a log: given the merges
+# consolidate() makes (pass it, or a Tee including it, as the log),
+# it updates the index for each in the same way, so one MoveGen
+# serves a whole turn. Building it indexes every pile, so a turn
+# costs O(piles) once, for that and for each consolidate() call; each
+# card looked up or played after that costs O(1), however many piles
+# there are. The index goes stale if the piles are changed by any
+# other means, so make a new MoveGen afterwards.
+#
+# Example:
+#   >>> F = [ [(11, 'hearts')], [(6, 'diamonds')], [(12, 'spades')], [(9, 'clubs')] ]
+#   >>> C = [ [(13, 'diamonds')], [], [], [] ]
+#   >>> gen = MoveGen(F, C)
+#   >>> gen.playable([(5, 'spades'), (9, 'hearts'), (13, 'clubs')])
+#   {(13, 'clubs'), (5, 'spades')}
+#   >>> gen.target((5, 'spades'))
+#   1
+#
+class MoveGen:
+    def __init__(self, F, C):
+        self.F = F
+        self.C = C
+        self.wanted = {}          # Card -> piles whose last card it can go on.
+        self.openF = []           # Empty foundations, in order.
+        self.openC = []           # Empty corners, in order.
+        nF = len(F)
+        for p in range(nF + len(C)):
+            S = F[p] if p < nF else C[p-nF]
+            if S != []:
+                for c in wants(S[-1]):
+                    self.wanted.setdefault(c, []).append(p)
+            elif p < nF:
+                self.openF.append(p)
+            else:
+                self.openC.append(p)
 
-            # If the hand is empty, return. Otherwise, reset move and
-            # keep trying.
-            if not hand:
-                return
-            move = []
-            pass
+    # Returns the set of cards in hand that can be played somewhere.
+    def playable(self, hand):
+        if self.openF:
+            return set(hand)      # Anything can start a foundation.
+        cards = self.wanted.keys() & hand
+        if self.openC:
+            cards.update(c for c in hand if isKing(c))
+        return cards
+
+    # Returns the pile the auto player puts card c on, or None if c
+    # can't be played. Piles are tried in pairs, corner j and then
+    # foundation j, for j = 0, 1, ...
+    def target(self, c):
+        nF = len(self.F)
+        piles = list(self.wanted.get(c, ()))
+        if self.openC and isKing(c):
+            piles.append(self.openC[0])
+        if self.openF:
+            piles.append(self.openF[0])
+        if not piles:
+            return None
+        return min(piles, key=lambda p: 2*p+1 if p < nF else 2*(p-nF))
+
+    # Logging: merges update the index. They are reported before they
+    # are made, so pile dst still ends with its old last card.
+    def turn(self, player, card=None):
+        pass
+
+    def move(self, src, dst, card):
+        if src == HAND:
+            return
+        nF = len(self.F)
+        S = self.F[dst] if dst < nF else self.C[dst-nF]
+        for w in wants(S[-1]):
+            self._drop(w, dst)
+        for w in wants(self.F[src][-1]):
+            self._drop(w, src)
+            self.wanted.setdefault(w, []).append(dst)
+        insort(self.openF, src)
+
+    def _drop(self, w, p):
+        piles = self.wanted[w]
+        piles.remove(p)
+        if not piles:
+            del self.wanted[w]
+
+    # Plays card c onto pile p, updating the index.
+    def play(self, c, p):
+        nF = len(self.F)
+        S = self.F[p] if p < nF else self.C[p-nF]
+        if S != []:
+            for w in wants(S[-1]):
+                self._drop(w, p)
+        elif p < nF:
+            self.openF.remove(p)
+        else:
+            self.openC.remove(p)
+        S.append(c)
+        for w in wants(c):
+            self.wanted.setdefault(w, []).append(p)
 
 ######################################################################
 # Plays a hand automatically using a fixed but not particularly
 # brilliant strategy. The strategy involves consolidating the table
 # (to collapse foundation and corner piles), then scanning cards in
 # your hand from highest to lowest, trying to place each card. The
-# process is repeated until no card can be placed. 
-def automove(F, C, hand):
+# process is repeated until no card can be placed. Moves are reported
+# to log; pass None (as simulate() does) to play silently. Returns the
+# number of cards played from the hand.
+#
+# automove() is autopolicy() (below) with its default options, which
+# are this strategy. merge is used in place of consolidate() if given
+# (e.g., a ConsolidateCache).
+def automove(F, C, hand, log=CONSOLE, merge=None):
+    return autopolicy(F, C, hand, log, merge=merge)
+
+######################################################################
+# A tunable version of automove(), for trying out variations on its
+# strategy (e.g., with sweep.py). Only cards with a legal move are
+# scanned: a MoveGen supplies them, and each card played adds just the
+# (lower) cards that can now go on top of it. merge is used in place
+# of consolidate() if given. POLICY lists each option's choices, the
+# first being what automove() does:
+#
+#   order    'high' scans the hand from the highest card down, 'low'
+#            from the lowest card up.
+#   merging  'before' consolidates the table before placing cards,
+#            'after' places cards first and consolidates afterwards.
+#   kings    where a king goes: 'corner' tries corner j, then
+#            foundation j, for j = 0, 1, ... (as for other cards);
+#            'foundation' prefers an empty foundation; 'last' holds
+#            kings back until no other card can be played.
+#
+# Example:
+#   >>> simulate(2000, 3, seed=1, strategy=autopolicy) == simulate(2000, 3, seed=1)
+#   True
+#   >>> from functools import partial
+#   >>> mix = [automove, partial(autopolicy, kings='last'), partial(autopolicy, order='low')]
+#   >>> [ sum(r[0] == i for r in simulate(2000, 3, seed=1, strategy=mix)) for i in range(3) ]
+#   [642, 704, 654]
+#
+POLICY = { 'order': ('high', 'low'), 'merging': ('before', 'after'), 'kings': ('corner', 'foundation', 'last') }
+
+def autopolicy(F, C, hand, log=CONSOLE, order='high', merging='before', kings='corner', merge=None):
+    if merge is None:
+        merge = consolidate
+    played = 0
+    # One MoveGen for the whole turn, told about every merge.
+    gen = MoveGen(F, C)
+    merges = Tee(log, gen) if log else gen
     # Keep playing cards while you're able to move something.
     moved = True
     while moved:
-        moved = False	# Change back to True if you move a card.
-
-        # Start by consolidating the table.        
-        consolidate(F, C)
-        # Sort the hand (destructively) so that you consider highest
-        # value cards first.
+        moved = False
+        if merging == 'before':
+            merge(F, C, merges)
         hand.sort()
-        # Scan cards in hand from high to low value, which makes removing
-        # elements easier.
-        for i in range(len(hand)-1, -1, -1):
-            # If current card is a king, place in an empty corner
-            # location (guaranteed to be one).
-                        
-            # Otherwise, try to place current card on an existing
-            # corner or foundation pile.
-            for j in range(4):           #iterates through the 4 lists that F and C contain 
-                # Here, you have an if/elif/else that checks each of
-                # the stated conditions.
-                # Place current card on corner pile.
-                if hand[i][0] == "13":
-                    if C[j] == []: 
-                        print("Moving {} to an open corner".format(displayCard(hand[i])))
-                        x.append(hand[i])
-                        hand.remove(hand[i])
-                        
-                if legal(C[j], hand[i]) is True:             #If the current card is appendable to any existing corner pile:
-                    print("Moving {} to {}".format(displayCard(hand[i]), C[j]))      #Prints out what it is doing
-                    C[j].append(hand[i])                     #Adds it to the legal corner pile 
-                    hand.remove(hand[i])                     #Removes the existing card from the hand
-                    
-                # Place current card on foundation pile.
-                if legal(F[j], hand[i]) is True:             #If the current card is appendable to any existing foundation:
-                    print("Moving {} to F{}".format(displayCard(hand[i]), j))      #Prints out what it is doing
-                    F[j].append(hand[i])                       #Adds it to the legal foundation pile
-                    hand.remove(hand[i])                       #Removes the existing card from the hand
-                    
-                # Start a new foundation pile.              
-                if F[j] == []:
-                    print("Moving {} to an open foundation".format(displayCard(hand[i])))
-                    F[j].append(hand[i])
-                    hand.remove(hand[i])
-                    break
+        todo = sorted(gen.playable(hand))
+        held = []           # Kings held back, for kings='last'.
+        while todo or held:
+            if not todo:
+                todo, held = sorted(held), []
+            card = todo.pop() if order == 'high' else todo.pop(0)
+            if isKing(card):
+                if kings == 'last' and any(not isKing(c) for c in todo):
+                    held.append(card)
+                    continue
+                if kings == 'foundation' and gen.openF:
+                    p = gen.openF[0]
+                else:
+                    p = gen.target(card)
+            else:
+                p = gen.target(card)
+            if p is None:
+                continue
+            if log:
+                log.move(HAND, p, card)
+            gen.play(card, p)
+            hand.remove(card)
+            played = played + 1
+            moved = True
+            for c in wants(card):
+                if c in hand and c not in todo:
+                    insort(todo, c)
+        if merging == 'after' and merge(F, C, merges):
+            moved = True
+    return played
+
 ######################################################################
 # consolidate(F, C) looks for opportunities to consolidate by moving a
 # foundation pile to a corner pile or onto another foundation pile. It
 # is used by the auto player to consolidate elements on the table to
-# make it more playable.
+# make it more playable. Any number of foundation and corner piles is
+# allowed. Merges are reported to log; pass None to consolidate
+# silently. Returns the number of piles merged.
+#
+# Rather than trying every pair of piles, consolidate() indexes the
+# non-empty piles by the rank and colour their last card needs next
+# (see cardKeys()), and the foundations by the rank and colour of
+# their first card. A foundation can move exactly when its first card
+# matches what some other pile needs. Merging only changes what the
+# receiving pile needs, so after a merge the only new candidates are
+# the foundations whose first card matches that one new key. Merging
+# stops when no foundation can move; the lowest numbered foundation
+# that can move always goes first, onto the lowest numbered pile
+# (foundations, then corners) that will take it.
 #
 # Example:
-#   >>> showTable(F, C)
-#     F0: 6♢...6♢
-#     F1: 10♣...10♣
-#     F2: J♡...J♡
-#     F3: Q♠...Q♠
-#     C4: K♢...K♢
-#     C5:
-#     C6:
-#     C7:
+#   >>> F = [ [(6, 'diamonds')], [(10, 'clubs')], [(11, 'hearts')], [(12, 'spades')] ]
+#   >>> C = [ [(13, 'diamonds')], [], [], [] ]
 #   >>> consolidate(F, C)
+#   Moving F1 to F2
+#   Moving F2 to F3
+#   Moving F3 to C4
+#   3
 #   >>> showTable(F, C)
-#     F0: 6♢...6♢
-#     F1:
-#     F2: 
-#     F3: 
-#     C4: K♢...10♣
-#     C5:
-#     C6:
-#     C7:
+#   F0: 6♢...6♢
+#   F1: 
+#   F2: 
+#   F3: 
+#   C4: K♢...10♣
+#   C5: 
+#   C6: 
+#   C7: 
+
+# Returns the (have, need) consolidation keys of card c: have
+# identifies its rank and colour, need the rank and colour of a card
+# that could be played on it. Works for both card representations.
+def cardKeys(c):
+    if c.__class__ is int:
+        return HAVE[c], NEED[c]
+    color = COLORS[c[1]]
+    return 2*c[0] + color, 2*(c[0]-1) + 1-color
+
+def consolidate(F, C, log=CONSOLE):
+    nF = len(F)
+    needs = {}       # Need key -> piles (0.. foundations, nF.. corners) whose last card needs it.
+    heads = {}       # Have key -> foundations whose first card has it.
+    for i in range(nF + len(C)):
+        S = F[i] if i < nF else C[i-nF]
+        if S != []:
+            needs.setdefault(cardKeys(S[-1])[1], []).append(i)
+            if i < nF:
+                heads.setdefault(cardKeys(S[0])[0], []).append(i)
+
+    # Candidate foundations to move, lowest first.
+    todo = [ b for k in heads if k in needs for b in heads[k] ]
+    heapify(todo)
+    merged = 0
+    while todo:
+        b = heappop(todo)
+        if F[b] == []:
+            continue
+        have = cardKeys(F[b][0])[0]
+        dst = [ a for a in needs.get(have, ()) if a != b ]
+        if not dst:
+            continue
+        a = min(dst)
+        S = F[a] if a < nF else C[a-nF]
+
+        if log:
+            log.move(b, a, F[b][0])
+        # Unindex both piles, merge, then index the new last card of a.
+        needs[cardKeys(S[-1])[1]].remove(a)
+        needs[cardKeys(F[b][-1])[1]].remove(b)
+        heads[have].remove(b)
+        S.extend(F[b])
+        F[b] = F[b][:0]          # An empty pile of the same kind.
+        need = cardKeys(S[-1])[1]
+        needs.setdefault(need, []).append(a)
+        merged = merged + 1
+        for f in heads.get(need, ()):
+            heappush(todo, f)
+    return merged
+
+######################################################################
+# ConsolidateCache memoizes consolidate(). Like the rules (see
+# legal()), consolidate() only looks at the ends of each pile, so the
+# tuple of (first, last) pairs, foundations then corners, is used as
+# a key for the merge plan, the list of (from, to) pile moves it
+# makes. A cache is called just like consolidate(): on a hit, the
+# stored plan is replayed; on a miss, the plan is worked out by
+# consolidating two-card stand-ins for the piles, then stored. The
+# size least recently used plans are kept; hits and misses count
+# lookups.
+#
+# Example:
+#   >>> from functools import partial
+#   >>> cache = ConsolidateCache(10000)
+#   >>> results = simulate(1000, seed=1, strategy=partial(automove, merge=cache))
+#   >>> cache.hits, cache.misses
+#   (21982, 20315)
+#
+class ConsolidateCache:
+    def __init__(self, size=65536):
+        self.size = size
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.plans)
+
+    def __call__(self, F, C, log=CONSOLE):
+        key = tuple((S[0], S[-1]) if S else None for S in F + C)
+        plan = self.plans.get(key)
+        if plan is None:
+            self.misses = self.misses + 1
+            piles = [ [] if p is None else [p[0]] if p[0] == p[1] else list(p) for p in key ]
+            moves = EventLog(len(F)+1)
+            consolidate(piles[:len(F)], piles[len(F):], moves)
+            plan = tuple((src, dst) for player, src, dst, card in moves)
+            self.plans[key] = plan
+            if len(self.plans) > self.size:
+                self.plans.popitem(last=False)
+        else:
+            self.hits = self.hits + 1
+            self.plans.move_to_end(key)
+        for b, a in plan:
+            if log:
+                log.move(b, a, F[b][0])
+            (F[a] if a < len(F) else C[a-len(F)]).extend(F[b])
+            F[b] = F[b][:0]
+        return len(plan)
+
+######################################################################
+# A stronger (and slower) auto player. Rather than placing cards
+# greedily, searchmove() searches the sequences of moves available
+# this turn -- playing a hand card onto a pile, starting a foundation,
+# putting a king in a corner, or moving a foundation onto another pile
+# -- depth first, up to depth moves deep. It then makes the best
+# sequence found, looking ahead to the next player's turn: each card
+# played scores weight points, and each unseen card (one not on the
+# table or in hand) that the next player could then play costs one.
+# A table left with an empty foundation, or with a foundation the
+# next player can merge away to empty one, lets them play anything;
+# otherwise they can play the cards the piles want, plus kings if a
+# corner is empty. So the search will, e.g., hold back a card rather
+# than open up several more for the next player, and prefers to close
+# off foundations and fill corners with kings.
+#
+# The search runs on a GameState of the table and hand, making and
+# taking back moves with apply() and undo(), so the real piles are
+# only touched once the best sequence is known, and each pile is
+# copied at most once (when the search first writes to it) however
+# many positions are searched. Only the ends of each pile matter (see
+# legal()), and positions that differ only in the order of the
+# foundations, or of the corners, are the same position, so each one
+# is keyed by its sorted (first, last) pairs and hand in a
+# transposition table and searched only once (unless it's reached
+# again with more depth to spare). The search stops after nodes
+# positions, or after seconds seconds if given, and keeps the best
+# sequence found so far; if it was cut short, whatever can still be
+# played after that is played greedily by automove(). Moves are
+# reported to log.
+#
+# Unseen cards are counted against a shoe of decks decks; by default,
+# as few as a table of players players needs (see decksFor()), which
+# is one deck for the usual table. Pass either for larger tables, e.g.
+# partial(searchmove, players=10) as a strategy.
+# Returns the number of cards played from the hand.
+#
+# Example (automove() would put the king in a corner and the 9 on F1,
+# leaving F3 empty for the next player):
+#   >>> F = [ [(6, 'diamonds')], [(5, 'spades')], [(12, 'spades')], [(4, 'hearts')] ]
+#   >>> C = [ [], [], [], [] ]
+#   >>> searchmove(F, C, [(13, 'clubs'), (9, 'hearts')])
+#   Moving F1 to F0
+#   Moving F3 to F0
+#   Moving K♣ to F1
+#   Moving 9♡ to F3
+#   2
+#
+def searchmove(F, C, hand, log=CONSOLE, depth=16, nodes=5000, seconds=None, weight=10, players=2, decks=None):
+    nF = len(F)
+    state = GameState(F, C, [sorted(hand)], [])
+    seen = {}        # Transposition table: position -> depth left when searched.
+    path = []        # Moves leading to the current position.
+
+    # How many of each card the other players might hold: every copy
+    # of it in the shoe, less those on the table and in hand.
+    counts = [0]*52
+    for S in F + C:
+        for c in S:
+            counts[cardCode(c)] += 1
+    for c in hand:
+        counts[cardCode(c)] += 1
+    copies = max(decks or decksFor(players, nF), max(counts))
+    unseen = [ copies - n for n in counts ]
+    total = sum(unseen)
+    kings = sum(unseen[KING:])
+
+    # The number of unseen cards the next player could play onto the
+    # table as it stands: everything if a foundation is (or can be
+    # made) empty, else what the piles want, plus kings if a corner is
+    # empty.
+    def mobility():
+        piles = state.F + state.C
+        if any(S == [] for S in state.F):
+            return total
+        for b in range(nF):
+            for a in range(len(piles)):
+                if a != b and legal(piles[a], state.F[b][0]):
+                    return total
+        wanted = set()
+        for S in piles:
+            if S != []:
+                wanted.update(WANTLIST[cardCode(S[-1])])
+        n = sum(unseen[w] for w in wanted)
+        if any(S == [] for S in state.C):
+            n = n + kings
+        return n
+
+    def score():
+        return (len(hand) - len(state.H[0]))*weight - mobility()
+
+    best = [None, []]
+    budget = [nodes]
+    deadline = None if seconds is None else perf_counter() + seconds
+
+    # The moves from the current position, from GameState.moves():
+    # merges first, then the highest cards, each card tried once; of
+    # several empty foundations (or corners) only the first is tried.
+    def moves():
+        openF = next((p for p in range(nF) if state.F[p] == []), None)
+        openC = next((p + nF for p in range(len(state.C)) if state.C[p] == []), None)
+        merges = []
+        plays = []
+        for move in state.moves():
+            src, p, c = move
+            if state.pile(p) == [] and p != openF and p != openC:
+                continue
+            if src != HAND:
+                merges.append(move)
+            elif move not in plays:
+                plays.append(move)
+        plays.sort(key=lambda m: m[2], reverse=True)
+        return merges + plays
+
+    def search(d):
+        if budget[0] <= 0:
+            return
+        key = (tuple(sorted((S[0], S[-1]) for S in state.F if S != [])),
+               tuple(sorted((S[0], S[-1]) for S in state.C if S != [])), tuple(state.H[0]))
+        if seen.get(key, -1) >= d:
+            return
+        seen[key] = d
+        budget[0] = budget[0] - 1
+        if deadline is not None and budget[0] % 256 == 0 and perf_counter() > deadline:
+            budget[0] = 0
+        value = score()
+        if best[0] is None or value > best[0]:
+            best[:] = [value, list(path)]
+        if d == 0:
+            return
+        for move in moves():
+            state.apply(move)
+            path.append(move)
+            search(d-1)
+            path.pop()
+            state.undo()
+
+    search(depth)
+
+    # Now make the moves for real.
+    played = 0
+    for src, a, c in best[1]:
+        S = F[a] if a < nF else C[a-nF]
+        if src != HAND:
+            if log:
+                log.move(src, a, F[src][0])
+            S.extend(F[src])
+            F[src] = F[src][:0]
+        else:
+            if log:
+                log.move(HAND, a, c)
+            S.append(c)
+            hand.remove(c)
+            played = played + 1
+    # If the search was cut short, play whatever else is playable.
+    if budget[0] <= 0:
+        played = played + automove(F, C, hand, log)
+    return played
+
+######################################################################
+# GameState holds a whole game -- foundations F, corners C, hands H,
+# deck D and the player to move -- for search and what-if analysis.
+# Moves are (src, dst, card) triples, as in event logs: (HAND, p, c)
+# plays card c from the current player's hand onto pile p, (b, p, c)
+# moves foundation b (whose first card is c) onto pile p, (DECK, HAND,
+# c) draws the next card, c, from the deck, and PASS ends the turn.
+# apply(move) checks and makes a move, raising ValueError if it isn't
+# legal; undo() takes back the last one. Each costs at most a pile's
+# worth of copying, whatever the size of the game.
+#
+# fork() makes a copy that shares all its piles and hands with the
+# original. A pile or hand is only copied when one of the two states
+# first writes to it (so states never see each other's moves), and
+# the deck, which is never written, is always shared. The original's
+# undo stack is unaffected, while the fork starts with an empty one.
+#
+# Example:
+#   >>> F = [ [(11, 'hearts')], [(6, 'diamonds')], [(12, 'spades')], [(9, 'clubs')] ]
+#   >>> C = [ [(13, 'diamonds')], [], [], [] ]
+#   >>> H = [ [(5, 'spades'), (9, 'hearts')], [(2, 'clubs'), (10, 'diamonds')] ]
+#   >>> D = [ (8, 'hearts'), (4, 'clubs') ]
+#   >>> s = GameState(F, C, H, D)
+#   >>> s.apply((DECK, HAND, D[0]))
+#   >>> t = s.fork()
+#   >>> t.apply((HAND, 1, (5, 'spades')))
+#   >>> t.F[1][-1], s.F[1][-1]
+#   ((5, 'spades'), (6, 'diamonds'))
+#   >>> t.undo()
+#
+PASS = (HAND, HAND, None)
+
+class GameState:
+    __slots__ = ('F', 'C', 'H', 'D', 'top', 'player', 'stack', 'owned')
+
+    # The given lists are never changed; the state copies what it needs
+    # to write. D is the deck still to be drawn from.
+    def __init__(self, F, C, H, D, player=0):
+        self.F = list(F)
+        self.C = list(C)
+        self.H = list(H)
+        self.D = D
+        self.top = 0              # Index in D of the next card to draw.
+        self.player = player
+        self.stack = []           # Undo information, one entry per move.
+        self.owned = 0            # Bit p set if pile p (then hand j at bit len(F)+len(C)+j) is ours to write.
+
+    def pile(self, p):
+        return self.F[p] if p < len(self.F) else self.C[p-len(self.F)]
+
+    # The cards left in the deck.
+    def deck(self):
+        return self.D[self.top:]
+
+    # Returns pile p, first copying it unless it's ours to write.
+    def _writePile(self, p):
+        S = self.pile(p)
+        if not self.owned >> p & 1:
+            S = list(S)
+            if p < len(self.F):
+                self.F[p] = S
+            else:
+                self.C[p-len(self.F)] = S
+            self.owned |= 1 << p
+        return S
+
+    # Returns the current player's hand, copying it unless it's ours.
+    def _writeHand(self):
+        bit = len(self.F) + len(self.C) + self.player
+        if not self.owned >> bit & 1:
+            self.H[self.player] = list(self.H[self.player])
+            self.owned |= 1 << bit
+        return self.H[self.player]
+
+    def apply(self, move):
+        src, dst, card = move
+        nF = len(self.F)
+        if src == DECK:
+            if self.top >= len(self.D) or (card is not None and self.D[self.top] != card):
+                raise ValueError('{} is not the next card in the deck'.format(card))
+            self._writeHand().append(self.D[self.top])
+            self.top = self.top + 1
+            self.stack.append((DECK,))
+        elif move == PASS:
+            self.stack.append((PASS, self.player))
+            self.player = (self.player + 1) % len(self.H)
+        elif not 0 <= dst < nF + len(self.C):
+            raise ValueError('there is no pile {}'.format(dst))
+        elif src == HAND:
+            S = self.pile(dst)
+            if not (legal(S, card) or (S == [] and (dst < nF or isKing(card)))) or card not in self.H[self.player]:
+                raise ValueError("{} can't go on pile {}".format(card, dst))
+            hand = self._writeHand()
+            i = hand.index(card)
+            del hand[i]
+            self._writePile(dst).append(card)
+            self.stack.append((HAND, dst, i))
+        elif 0 <= src < nF:
+            moved = self.F[src]
+            if moved == [] or src == dst or moved[0] != card or not legal(self.pile(dst), card):
+                raise ValueError("F{} can't go on pile {}".format(src, dst))
+            S = self._writePile(dst)
+            n = len(S)
+            S.extend(moved)
+            self.F[src] = []
+            self.stack.append((src, dst, n, moved, self.owned >> src & 1))
+            self.owned |= 1 << src
+        else:
+            raise ValueError('only foundations and cards in hand can be moved')
+
+    def undo(self):
+        entry = self.stack.pop()
+        if entry[0] == DECK:
+            self._writeHand().pop()
+            self.top = self.top - 1
+        elif entry[0] == PASS:
+            self.player = entry[1]
+        elif entry[0] == HAND:
+            card = self._writePile(entry[1]).pop()
+            self._writeHand().insert(entry[2], card)
+        else:
+            src, dst, n, moved, owned = entry
+            del self._writePile(dst)[n:]
+            self.F[src] = moved
+            self.owned = self.owned & ~(1 << src) | owned << src
+
+    # Returns a copy of the state sharing all of its piles and hands.
+    # Neither state owns them any more, so whichever writes to one
+    # first copies it.
+    def fork(self):
+        s = GameState.__new__(GameState)
+        s.F = list(self.F)
+        s.C = list(self.C)
+        s.H = list(self.H)
+        s.D = self.D
+        s.top = self.top
+        s.player = self.player
+        s.stack = []
+        s.owned = 0
+        self.owned = 0
+        return s
+
+    # Lists the legal moves for the player to move, other than drawing
+    # and passing: foundation merges as (b, p, first card), then hand
+    # cards as (HAND, p, card).
+    def moves(self):
+        nF = len(self.F)
+        nP = nF + len(self.C)
+        result = []
+        for b in range(nF):
+            if self.F[b] != []:
+                for p in range(nP):
+                    if p != b and legal(self.pile(p), self.F[b][0]):
+                        result.append((b, p, self.F[b][0]))
+        for card in self.H[self.player]:
+            for p in range(nP):
+                S = self.pile(p)
+                if legal(S, card) or (S == [] and (p < nF or isKing(card))):
+                    result.append((HAND, p, card))
+        return result
+
+######################################################################
+# Zobrist-style 64-bit hashing of positions, for memo caches and for
+# spotting repeated positions across simulated games. A PositionHash
+# is computed once from F, C, H, D and the player to move, and is then
+# kept up to date in O(1) per move by using it as an event log (pass
+# it, or a Tee including it, as the log argument of automove(),
+# consolidate(), playout() and so on).
+#
+# The hash is a sum (mod 2**64) of random keys from a fixed seed, so
+# the same position hashes the same way in every run and process:
+#
+#   each pile       a key for (foundation or corner, first, last card)
+#   each hand card  a key for (player, card)
+#   each deck card  a key for the card (the deck counts as a set)
+#   player to move  a key for the player
+#
+# Adding the pile keys up means the order of the foundations, or of
+# the corners, doesn't matter, just as it doesn't under the rules;
+# and only the first and last card of a pile count (see legal()).
+# The rules also only care about colour, not suit, so relabelling the
+# suits in a way that keeps same-coloured suits the same colour as
+# each other (e.g. swapping spades and clubs, or swapping red and
+# black altogether) gives an equivalent position. The hash is kept
+# for all 8 such relabellings, and value() returns the smallest,
+# which is the same for all equivalent positions; exact() returns the
+# hash of the position as it stands.
+#
+# Example (with F, C, H and D as in the GameState example):
+#   >>> h = PositionHash(F, C, H, D)
+#   >>> played = automove(F, C, H[0], h)
+#   >>> h.value() == PositionHash(F, C, H, D).value()
+#   True
+#
+def _symmetries():
+    result = []
+    for p in permutations(range(4)):
+        if all((COLOR[s] == COLOR[t]) == (COLOR[p[s]] == COLOR[p[t]]) for s in range(4) for t in range(4)):
+            result.append([ c - c%4 + p[c%4] for c in range(52) ])
+    return result
+
+SYMMETRIES = _symmetries()
+_keys = Random(0x4b696e6773436f72)
+ZPILE = [ [ [ _keys.getrandbits(64) for t in range(52) ] for h in range(52) ] for kind in range(2) ]
+ZHAND = [ [ _keys.getrandbits(64) for c in range(52) ] for player in range(16) ]
+ZDECK = [ _keys.getrandbits(64) for c in range(52) ]
+ZTURN = [ _keys.getrandbits(64) for player in range(16) ]
+MASK64 = (1 << 64) - 1
+
+class PositionHash:
+    __slots__ = ('nF', 'piles', 'player', 'hashes')
+
+    def __init__(self, F, C, H, D, player=0):
+        self.nF = len(F)
+        self.piles = [ (cardCode(S[0]), cardCode(S[-1])) if S else None for S in F + C ]
+        self.player = player
+        self.hashes = []
+        for sym in SYMMETRIES:
+            h = ZTURN[player]
+            for p, pile in enumerate(self.piles):
+                if pile is not None:
+                    h = h + ZPILE[p >= self.nF][sym[pile[0]]][sym[pile[1]]]
+            for j, hand in enumerate(H):
+                for c in hand:
+                    h = h + ZHAND[j][sym[cardCode(c)]]
+            for c in D:
+                h = h + ZDECK[sym[cardCode(c)]]
+            self.hashes.append(h & MASK64)
+
+    def value(self):
+        return min(self.hashes)
+
+    def exact(self):
+        return self.hashes[0]
+
+    # Adds the given key to every hash, taking the card arguments
+    # through each relabelling in turn: table is a list of keys
+    # indexed by card, or by first then last card for ZPILE.
+    def _add(self, sign, table, *cards):
+        for k, sym in enumerate(SYMMETRIES):
+            key = table
+            for c in cards:
+                key = key[sym[c]]
+            self.hashes[k] = (self.hashes[k] + sign*key) & MASK64
+
+    def turn(self, player, card=None):
+        for k in range(len(SYMMETRIES)):
+            self.hashes[k] = (self.hashes[k] - ZTURN[self.player] + ZTURN[player]) & MASK64
+        self.player = player
+        if card is not None:
+            c = cardCode(card)
+            self._add(-1, ZDECK, c)
+            self._add(+1, ZHAND[player], c)
+
+    def move(self, src, dst, card):
+        c = cardCode(card)
+        old = self.piles[dst]
+        kind = ZPILE[dst >= self.nF]
+        if old is not None:
+            self._add(-1, kind, old[0], old[1])
+        if src == HAND:
+            self._add(-1, ZHAND[self.player], c)
+            new = (c if old is None else old[0], c)
+        else:
+            moved = self.piles[src]
+            self._add(-1, ZPILE[0], moved[0], moved[1])
+            self.piles[src] = None
+            new = (c if old is None else old[0], moved[1])
+        self.piles[dst] = new
+        self._add(+1, kind, new[0], new[1])
+
+# Returns the encoded form of card c.
+def cardCode(c):
+    return c if c.__class__ is int else encodeCard(c)
+
+######################################################################
+# Plays out one complete game between N auto players without printing
+# anything, drawing all randomness from rng (a random.Random). Returns
+# a (winner, turns, left) tuple, where winner is the number of the
+# player who went out (or None if the deck ran dry and nobody could
+# move for two full rounds), turns is the number of turns taken, and
+# left is a tuple giving the number of cards remaining in each hand.
+# Games are played with encoded cards, which is faster but gives the
+# same result as playing with (v, s) tuples. piles sets the number of
+# foundation piles, and of corner piles. strategy is the function each
+# player uses to take their turn (automove() by default, or e.g.
+# searchmove()), or a list giving one per player. If log is given,
+# the game's events are reported to it. pile is the type used for the
+# piles on the table: list, or e.g. Pile for smaller, faster tables.
+# Cards are dealt from a shoe of decks decks (by default, as few as
+# the table needs; see decksFor()), so games of up to 16 players or
+# more can be played.
+#
+# Example:
+#   >>> autoplay(2, Random(1))
+#   (0, 11, (0, 2))
+#
+def autoplay(N, rng, piles=4, strategy=automove, log=None, pile=list, decks=None):
+    D, H, F = deal(N, createShoe(decks or decksFor(N, piles), encoded=True), rng, piles)
+    F = [ pile(S) for S in F ]
+    C = [ pile() for i in range(piles) ]   # Corners, initially empty.
+    return playout(D, H, F, C, rng.randint(0, N-1), strategy, log)
+
+######################################################################
+# Plays out the rest of a game silently from any position: D is the
+# deck, H the list of hands, F and C the table, and player the player
+# about to take a turn (and draw a card). strategy and log are as in
+# autoplay(). Returns the same (winner, turns, left) tuple as
+# autoplay(), counting turns from this position.
+def playout(D, H, F, C, player, strategy=automove, log=None):
+    N = len(H)
+    if not isinstance(D, Deck):
+        D = Deck(D)
+    if not isinstance(strategy, (list, tuple)):
+        strategy = [strategy]*N
+    turns = 0
+    stalled = 0      # Consecutive turns, with the deck empty, where nobody played.
+    while stalled < 2*N:
+        turns = turns + 1
+        card = None
+        if PROFILE:
+            start = perf_counter()
+        if D:
+            card = D.draw()
+            H[player].append(card)
+        if PROFILE:
+            PROFILE.add('draw', perf_counter() - start)
+        if log:
+            log.turn(player, card)
+        if PROFILE:
+            start = perf_counter()
+            before = len(H[player])
+        played = strategy[player](F, C, H[player], log)
+        if PROFILE:
+            PROFILE.add('move', perf_counter() - start)
+            PROFILE.turn(before - len(H[player]))
+        if played or D:
+            stalled = 0
+        else:
+            stalled = stalled + 1
+        if H[player] == []:
+            return player, turns, tuple(len(h) for h in H)
+        player = (player + 1) % N
+    return None, turns, tuple(len(h) for h in H)
+
+######################################################################
+# Monte Carlo estimate of each player's chance of winning from a
+# mid-game position. F and C are the table and hand is the hand of the
+# player about to move (before they draw); the players are numbered
+# from the one about to move, who is player 0. ndeck is the number of
+# cards left in the deck, and others lists the number of cards in each
+# other player's hand, in turn order. The cards come from a shoe of
+# decks decks (by default, as few as the table needs; see decksFor()).
+#
+# Each rollout deals the cards not on the table or in hand at random
+# into the other hands and the deck, then plays the game out with
+# strategy (automove() by default). Rollouts run in batches of batch
+# games; after each batch, the 95% confidence interval on every
+# player's win probability is checked, and the estimate is returned
+# as soon as none is wider than +/- tol, or after limit rollouts.
+#
+# Returns a (probs, margin, n) tuple: the estimated win probability
+# of each player (stalled games are nobody's win, so these can sum to
+# less than 1), the widest confidence half-width, and the number of
+# rollouts played. Raises ValueError if the card counts don't add up.
+# Every card on the table is counted, so piles must be lists or Piles
+# with history (a Pile without raises TypeError).
+#
+# Example:
+#   >>> D, H, F = deal(2, createDeck(), Random(5))
+#   >>> C = [ [] for i in range(4) ]
+#   >>> winProbability(F, C, H[0], len(D), [len(H[1])], seed=1)
+#   ([0.4954545454545455, 0.5045454545454545], 0.02949332401455395, 1100)
+#
+def winProbability(F, C, hand, ndeck, others, seed=None, tol=0.03, batch=100, limit=10000, strategy=automove, decks=None):
+    table = [ c for S in F + C for c in S ] + list(hand)
+    encoded = any(c.__class__ is int for c in table)
+    # Take each card on the table or in hand out of the shoe once, so
+    # that with several decks the other copies are still unseen.
+    seen = {}
+    for c in table:
+        seen[c] = seen.get(c, 0) + 1
+    unseen = []
+    for c in createShoe(decks or decksFor(len(others) + 1, len(F)), encoded):
+        if seen.get(c):
+            seen[c] = seen[c] - 1
+        else:
+            unseen.append(c)
+    if len(unseen) != ndeck + sum(others):
+        raise ValueError('{} unseen cards, but {} in the deck and other hands'.format(len(unseen), ndeck + sum(others)))
 
-def consolidate(F, C):
-    # Consider moving one foundation onto another. 
-    if F[0] != []:
-        if legal(F[0], F[1][0]) is True:
-            F[0].extend(F[1]) 
-            F[1] = [] 
-            print("Moving F1 to F0")
-        if legal(F[0], F[2][0]) is True:
-            F[0].extend(F[2])
-            F[2] = []
-            print("Moving F2 to F0")
-        if legal(F[0], F[3][0]) is True:
-            F[0].extend(F[3])
-            F[3] = []
-            print("Moving F3 to F0")        
-    if F[1] != []:
-        if legal(F[1], F[0][0]) is True:
-            F[1].extend(F[0])
-            F[0] = []
-            print("Moving F0 to F1")
-        if legal(F[1], F[2][0]) is True:
-            F[1].extend(F[2])
-            F[2] = []
-            print("Moving F2 to F1")
-        if legal(F[1], F[3][0]) is True:
-            F[1].extend(F[3])
-            F[3] = []
-            print("Moving F3 to F1")        
-    if F[2] != []:
-        if legal(F[2], F[0][0]) is True:
-            F[2].extend(F[0])
-            F[0] = []
-            print("Moving F0 to F2")
-        if legal(F[2], F[1][0]) is True:
-            F[2].extend(F[1])
-            F[1] = []
-            print("Moving F1 to F2")
-        if legal(F[2], F[3][0]) is True:
-            F[2].extend(F[3])
-            F[3] = []
-            print("Moving F3 to F2")        
-    if F[3] != []:
-        if legal(F[3], F[0][0]) is True:
-            F[3].extend(F[0])
-            F[0] = []
-            print("Moving F0 to F3")
-        if legal(F[3], F[1][0]) is True:
-            F[3].extend(F[1])
-            F[1] = []
-            print("Moving F1 to F3")
-        if legal(F[3], F[2][0]) is True:
-            F[3].extend(F[2])
-            F[2] = []
-            print("Moving F2 to F3")        
-    # Consider moving a foundation onto a corner.
-    if C[0] != []:
-        if legal(C[0], F[0][0]) is True:
-            C[0].extend(F[0])
-            F[0] = []
-            print("Moving F0 to C4")
-        if legal(C[0], F[1][0]) is True:
-            C[0].extend(F[1])
-            F[1] = []
-            print("Moving F1 to C4")
-        if legal(C[0], F[2][0]) is True:
-            C[0].extend(F[2])
-            F[2] = []
-            print("Moving F2 to C4")
-        if legal(C[0], F[3][0]) is True:
-            C[0].extend(F[3])
-            F[3] = []
-            print("Moving F3 to C4")
-    if C[1] != []:
-        if legal(C[1], F[0][0]) is True:
-            C[1].extend(F[0])
-            F[0] = []
-            print("Moving F0 to C5")
-        if legal(C[1], F[1][0]) is True:
-            C[1].extend(F[1])
-            F[1] = []
-            print("Moving F1 to C5")
-        if legal(C[1], F[2][0]) is True:
-            C[1].extend(F[2])
-            F[2] = []
-            print("Moving F2 to C5")
-        if legal(C[1], F[3][0]) is True:
-            C[1].extend(F[3])
-            F[3] = []
-            print("Moving F3 to C5")
-    if C[2] != []:
-        if legal(C[2], F[0][0]) is True:
-            C[2].extend(F[0])
-            F[0] = []
-            print("Moving F0 to C6")
-        if legal(C[2], F[1][0]) is True:
-            C[2].extend(F[1])
-            F[1] = []
-            print("Moving F1 to C6")
-        if legal(C[2], F[2][0]) is True:
-            C[2].extend(F[2])
-            F[2] = []
-            print("Moving F2 to C6")
-        if legal(C[2], F[3][0]) is True:
-            C[2].extend(F[3])
-            F[3] = []  
-            print("Moving F3 to C6")
-    if C[3] != []:
-        if legal(C[3], F[0][0]) is True:
-            C[3].extend(F[0])
-            F[0] = []
-            print("Moving F0 to C7")
-        if legal(C[3], F[1][0]) is True:
-            C[3].extend(F[1])
-            F[1] = []
-            print("Moving F1 to C7")
-        if legal(C[3], F[2][0]) is True:
-            C[3].extend(F[2])
-            F[2] = []
-            print("Moving F2 to C7")
-        if legal(C[3], F[3][0]) is True:
-            C[3].extend(F[3])
-            F[3] = []
-            print("Moving F3 to C7")
+    rng = Random(seed)
+    N = len(others) + 1
+    wins = [0]*N
+    n = 0
+    margin = 1.0
+    while n < limit:
+        for g in range(min(batch, limit-n)):
+            rng.shuffle(unseen)
+            H = [ list(hand) ]
+            i = 0
+            for k in others:
+                H.append(unseen[i:i+k])
+                i = i + k
+            winner = playout(unseen[i:], H, [ list(S) for S in F ], [ list(S) for S in C ], 0, strategy)[0]
+            if winner is not None:
+                wins[winner] = wins[winner] + 1
+            n = n + 1
+        # Widest 95% interval, using the Agresti-Coull adjustment so
+        # that early all-or-nothing batches don't look certain.
+        margin = 0.0
+        for w in wins:
+            p = (w + 2)/(n + 4)
+            margin = max(margin, 1.96*sqrt(p*(1-p)/(n + 4)))
+        if margin <= tol:
+            break
+    return [ w/n for w in wins ], margin, n
+
+######################################################################
+# Headless batch simulation: plays n_games games between n_players
+# auto players with no printing and returns a list of the per-game
+# (winner, turns, left) tuples produced by autoplay(). The whole batch
+# is reproducible from seed; piles, strategy, log, pile and decks are
+# passed on to autoplay(). With streams=True, game g is instead dealt
+# from its own Stream(seed, g), so any one game can be replayed on its
+# own, in any process, with autoplay(n_players, Stream(seed, g)).
+#
+# Example:
+#   >>> results = simulate(1000, 3, seed=42)
+#   >>> results[0]
+#   (0, 15, (0, 3, 5))
+#
+def simulate(n_games, n_players=2, seed=None, piles=4, strategy=automove, log=None, pile=list, streams=False, decks=None):
+    if streams:
+        return [ autoplay(n_players, Stream(seed, g), piles, strategy, log, pile, decks) for g in range(n_games) ]
+    rng = Random(seed)
+    return [ autoplay(n_players, rng, piles, strategy, log, pile, decks) for g in range(n_games) ]
+
+######################################################################
+# Plays one shard of a tournament; this is what each pool worker
+# runs. The input is an (n_games, n_players, seed) tuple, and the
+# output is an (n_games, wins, draws, turns, turns2) tuple, where wins
+# counts the games won by each seat, draws counts stalled games, and
+# turns and turns2 are the sum and sum of squares of the game lengths.
+def _shard(job):
+    n_games, n_players, seed = job
+    wins = [0]*n_players
+    draws = 0
+    turns = 0
+    turns2 = 0
+    for winner, t, left in simulate(n_games, n_players, seed):
+        if winner is None:
+            draws = draws + 1
+        else:
+            wins[winner] = wins[winner] + 1
+        turns = turns + t
+        turns2 = turns2 + t*t
+    return n_games, wins, draws, turns, turns2
+
+######################################################################
+# Multiprocess tournament runner. Splits n_games games between
+# n_players auto players into shards of at most chunk games, gives
+# each shard its own seed drawn from the master seed, and farms the
+# shards out to a pool of workers processes (all cores by default).
+# Statistics are merged as shards finish. Because the shard seeds
+# depend only on seed and chunk, the totals are the same whatever the
+# number of workers.
+#
+# Returns a dictionary with the number of games, the per-seat win
+# counts and win rates, the number of stalled games, and the mean and
+# standard deviation of the number of turns per game.
+#
+# Example:
+#   >>> tournament(4000, 4, seed=7)['winrate']
+#   [0.2485, 0.2575, 0.2445, 0.2495]
+#
+def tournament(n_games, n_players=2, seed=None, workers=None, chunk=1000):
+    rng = Random(seed)
+    jobs = []
+    for start in range(0, n_games, chunk):
+        jobs.append((min(chunk, n_games-start), n_players, rng.getrandbits(64)))
+
+    games = 0
+    wins = [0]*n_players
+    draws = 0
+    turns = 0
+    turns2 = 0
+    with Pool(workers) as pool:
+        for g, w, d, t, t2 in pool.imap_unordered(_shard, jobs):
+            games = games + g
+            wins = [ a + b for a, b in zip(wins, w) ]
+            draws = draws + d
+            turns = turns + t
+            turns2 = turns2 + t2
+
+    mean = turns/games if games else 0.0
+    return { 'games': games,
+             'wins': wins,
+             'winrate': [ w/games if games else 0.0 for w in wins ],
+             'draws': draws,
+             'turns': mean,
+             'turns_sd': max(turns2/games - mean*mean, 0.0)**0.5 if games else 0.0 }
+
+######################################################################
+# Opt-in profiling. While a Profile is active (in a with block), it
+# collects, for every game played in this process:
+#
+#   wall-clock time and number of calls for each phase of a turn:
+#     deal         deal()
+#     draw         drawing a card from the deck
+#     render       showTable(), showHand() and Renderer's frame() and
+#                  draw()
+#     move         the player's turn (automove(), usermove(), ...),
+#                  including any consolidating it does
+#     consolidate  consolidate()
+#   checks, the number of rule checks of each kind: calls to legal(),
+#     to wants() (by MoveGen and the auto players, for the cards a
+#     pile takes) and to cardKeys() (by consolidate())
+#   played[k], the number of turns in which k cards were played
+#
+# deal, render, consolidate and the checks are timed or counted by
+# swapping wrapped versions in for the module's own functions (and
+# Renderer's methods), which the rest of the module looks up by name,
+# so they cost nothing at all when no Profile is active. A phase
+# called from within itself (draw() calls frame()) is timed once. The
+# game loops (play() and playout()) time draw and move themselves,
+# and then only pay for an "if PROFILE:" test. Functions imported
+# elsewhere before profiling started, and games run in other
+# processes (e.g., by tournament()), aren't seen.
+#
+# report() returns the results as a dictionary, and save() writes
+# them to a JSON file; reset() starts over.
+#
+# Example:
+#   >>> with Profile() as prof:
+#   ...     results = simulate(1000, 3, seed=42)
+#   >>> r = prof.report()
+#   >>> r['phases']['deal']['calls'], r['checks'], r['played'][:4]
+#   (1000, {'legal': 0, 'wants': 180462, 'cardKeys': 330919},
+#    [3710, 3526, 3026, 2096])
+#
+PROFILE = None
+
+class Profile:
+    TIMED = (('deal', 'deal'), ('showTable', 'render'), ('showHand', 'render'), ('consolidate', 'consolidate'))
+    METHODS = (('frame', 'render'), ('draw', 'render'))      # Renderer's.
+    COUNTED = ('legal', 'wants', 'cardKeys')
+
+    def __init__(self):
+        self.reset()
+        self.saved = None
+        self.savedMethods = None
+
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.checks = dict.fromkeys(Profile.COUNTED, 0)
+        self.played = []
+        self.active = set()       # Phases being timed right now.
+
+    def __bool__(self):
+        return True
+
+    def add(self, phase, seconds):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    # Counts a turn in which n cards were played.
+    def turn(self, n):
+        if n >= len(self.played):
+            self.played.extend([0]*(n+1-len(self.played)))
+        self.played[n] = self.played[n] + 1
+
+    def _timed(self, phase, fn):
+        def timed(*args, **kwargs):
+            if phase in self.active:
+                return fn(*args, **kwargs)
+            self.active.add(phase)
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(phase, perf_counter() - start)
+                self.active.discard(phase)
+        return timed
+
+    def _counted(self, name, fn):
+        checks = self.checks
+        def counted(*args):
+            checks[name] = checks[name] + 1
+            return fn(*args)
+        return counted
+
+    def __enter__(self):
+        global PROFILE
+        if PROFILE is not None:
+            raise ValueError('a Profile is already active')
+        names = [ name for name, phase in Profile.TIMED ] + list(Profile.COUNTED)
+        self.saved = { name: globals()[name] for name in names }
+        self.savedMethods = { name: getattr(Renderer, name) for name, phase in Profile.METHODS }
+        for name, phase in Profile.TIMED:
+            globals()[name] = self._timed(phase, self.saved[name])
+        for name in Profile.COUNTED:
+            globals()[name] = self._counted(name, self.saved[name])
+        for name, phase in Profile.METHODS:
+            setattr(Renderer, name, self._timed(phase, self.savedMethods[name]))
+        PROFILE = self
+        return self
+
+    def __exit__(self, *exc):
+        global PROFILE
+        globals().update(self.saved)
+        for name, fn in self.savedMethods.items():
+            setattr(Renderer, name, fn)
+        self.saved = None
+        self.savedMethods = None
+        PROFILE = None
+
+    def report(self):
+        turns = sum(self.played)
+        return { 'phases': { phase: { 'calls': self.calls[phase], 'seconds': self.seconds[phase] }
+                             for phase in sorted(self.calls) },
+                 'checks': dict(self.checks),
+                 'turns': turns,
+                 'played': list(self.played),
+                 'played_mean': sum(k*n for k, n in enumerate(self.played))/turns if turns else 0.0 }
+
+    def save(self, file):
+        with open(file, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+######################################################################
+# Game records. A game file stores complete games in fixed-width
+# binary records, so game i can be found by seeking, and a file of
+# hundreds of millions of games can be read by memory-mapping it.
+#
+# The file starts with an 8-byte header, the magic bytes b'KCG1' and
+# the record size, which is RECORD bytes for each deck in the shoe the
+# games are dealt from. Each record then holds:
+#
+#   players, piles, hand size, first player, winner (255 if nobody),
+#   decks in the shoe, and 2-byte counts of events and turns  10 bytes
+#   the deal, as 52 encoded cards per deck: the hands in
+#   turn, then the foundation seeds, then the deck in draw order
+#   the game's events, 4 bytes each as packed by packEvent()
+#
+# Unused event slots are zero. A record holds up to maxEvents(decks)
+# events; recordGames() raises ValueError for a game that doesn't fit.
+# Files from before shoes were recorded have 0 for the decks, meaning
+# one deck.
+#
+# Example:
+#   >>> with open('games.kcg', 'wb') as f:
+#   ...     recordGames(f, 1000, 3, seed=42)
+#   >>> games = GameFile('games.kcg')
+#   >>> len(games), games[0].winner, games[0].turns
+#   (1000, 0, 15)
+#   >>> D, H, F, C = games[0].replay(10)
+#
+RECORD = 1024
+RECORDHEAD = Struct('<BBBBBBHH')
+FILEHEAD = Struct('<4sI')
+
+# The number of events that fit in a record for a shoe of decks decks.
+def maxEvents(decks=1):
+    return (RECORD*decks - RECORDHEAD.size - 52*decks)//4
+
+MAXEVENTS = maxEvents()
+
+######################################################################
+# Plays n_games games, exactly as simulate() would (with the same
+# arguments, the results are the same), and writes each one to file
+# (opened for binary writing) as a game record. Returns the list of
+# (winner, turns, left) results. Raises ValueError for more than
+# MAXPILES piles a side, as pile numbers are stored in one byte.
+def recordGames(file, n_games, n_players=2, seed=None, piles=4, strategy=automove, decks=None):
+    if piles > MAXPILES:
+        raise ValueError('game records hold at most {} piles a side'.format(MAXPILES))
+    rng = Random(seed)
+    decks = decks or decksFor(n_players, piles)
+    size = RECORD*decks
+    limit = maxEvents(decks)
+    start = RECORDHEAD.size + 52*decks     # Where the events start.
+    file.write(FILEHEAD.pack(b'KCG1', size))
+    results = []
+    for g in range(n_games):
+        D, H, F = deal(n_players, createShoe(decks, encoded=True), rng, piles)
+        C = [ [] for i in range(piles) ]
+        first = rng.randint(0, n_players-1)
+        cards = [ c for h in H for c in h ] + [ S[0] for S in F ] + list(D)
+        log = EventLog(limit+1)
+        result = playout(D, H, F, C, first, strategy, log)
+        if log.count > limit:
+            raise ValueError('game {} has more than {} events'.format(g, limit))
+        winner, turns, left = result
+        record = bytearray(size)
+        RECORDHEAD.pack_into(record, 0, n_players, piles, HANDSIZE,
+                             first, 255 if winner is None else winner, decks, log.count, turns)
+        record[RECORDHEAD.size:start] = bytes(cards)
+        record[start:start+4*log.count] = b''.join(packEvent(e) for e in log)
+        file.write(record)
+        results.append(result)
+    return results
+
+######################################################################
+# A memory-mapped game file. len() gives the number of games, and
+# indexing or iterating gives GameRecords, which are views into the
+# mapped file; nothing is copied until a field is read. Because of
+# that, close() raises BufferError while any GameRecord is still in
+# use.
+class GameFile:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap(f.fileno(), 0, access=ACCESS_READ)
+        magic, size = FILEHEAD.unpack_from(self.map, 0)
+        if magic != b'KCG1':
+            raise ValueError('{} is not a game file'.format(path))
+        self.size = size
+        self.data = memoryview(self.map)
+
+    def __len__(self):
+        return (len(self.map) - FILEHEAD.size)//self.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i = i + len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('game index out of range')
+        start = FILEHEAD.size + i*self.size
+        return GameRecord(self.data[start:start+self.size])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.data.release()
+        self.map.close()
+
+######################################################################
+# One game record (see recordGames()), read from a buffer of a
+# record's bytes. events() iterates over the game's (player, src,
+# dst, card) events, and replay(n) rebuilds the position after the
+# first n events (all of them by default) as a (D, H, F, C) tuple,
+# checking every move against the rules as it goes.
+class GameRecord:
+    def __init__(self, data):
+        self.data = data
+        (self.players, self.piles, self.handsize, self.first, winner,
+         decks, self.nevents, self.turns) = RECORDHEAD.unpack_from(data, 0)
+        self.winner = None if winner == 255 else winner
+        self.decks = decks or 1
+
+    # The deal, as a memoryview of 52 encoded cards per deck.
+    def deal(self):
+        return self.data[RECORDHEAD.size:RECORDHEAD.size+52*self.decks]
+
+    def events(self):
+        start = RECORDHEAD.size + 52*self.decks
+        for player, src, dst, card in self.data[start:start+4*self.nevents].cast('B', (self.nevents, 4)).tolist():
+            yield (player, src, dst, None if card == 255 else card)
+
+    def replay(self, n=None):
+        cards = list(self.deal())
+        k = self.handsize
+        H = [ cards[i*k:(i+1)*k] for i in range(self.players) ]
+        F = [ [c] for c in cards[self.players*k:self.players*k+self.piles] ]
+        D = Deck(cards[self.players*k+self.piles:])
+        C = [ [] for i in range(self.piles) ]
+        for e, (player, src, dst, card) in enumerate(self.events()):
+            if n is not None and e >= n:
+                break
+            if src == DECK:
+                if card is not None:
+                    if not D or D[0] != card:
+                        raise ValueError('event {}: {} is not the next card in the deck'.format(e, card))
+                    H[player].append(D.draw())
+                continue
+            S = F[dst] if dst < self.piles else C[dst-self.piles]
+            if src == HAND:
+                ok = legal(S, card) or (S == [] and (dst < self.piles or isKing(card)))
+                if not ok or card not in H[player]:
+                    raise ValueError('event {}: illegal move'.format(e))
+                H[player].remove(card)
+                S.append(card)
+            else:
+                if F[src] == [] or F[src][0] != card or not legal(S, card):
+                    raise ValueError('event {}: illegal move'.format(e))
+                S.extend(F[src])
+                F[src] = []
+        return D, H, F, C
 
 ######################################################################
 if __name__ == '__main__':
@@ -0,0 +1,215 @@
+######################################################################
+# Vectorised batch engine for KingsCorner (needs NumPy). Instead of
+# playing games one at a time, Batch holds many games as NumPy arrays
+# and advances them all in lockstep, a turn at a time, applying the
+# auto player's strategy (automove() and consolidate()) to every game
+# at once with array operations:
+#
+#   hands    uint64 (games, players), each hand a 52-bit mask of
+#            encoded cards (see KingsCorner.encodeCard())
+#   tails    (games, piles) last card of each pile, foundations then
+#            corners; EMPTY (52) for an empty pile
+#   heads    (games, foundations) first card of each foundation
+#   deck     (games, cards) the undealt cards in draw order, with ptr
+#            the index of each game's next card
+#
+# Piles are kept as just their first and last cards, which is all the
+# rules look at (see KingsCorner.legal()). The legality test is the
+# same table lookup as legal(): FITS[t, c] is True if card c can go
+# on a pile whose last card is t (and False if either is EMPTY).
+#
+# Games are dealt exactly as autoplay() deals them (using deal() and
+# the same random numbers), and the strategy makes exactly the same
+# choices, so simulateBatch() returns the same results as simulate()
+# for the same arguments -- just a lot faster for large batches.
+#
+# Example:
+#   >>> simulateBatch(10000, 3, seed=42) == simulate(10000, 3, seed=42)
+#   True
+#
+import numpy as np
+
+from random import Random
+
+from KingsCorner import createDeck, deal, decksFor, handMask, WANTS, KING, HANDSIZE
+
+EMPTY = 52
+FITS = np.array([ [ t < 52 and c < 52 and WANTS[t] >> c & 1 == 1 for c in range(53) ] for t in range(53) ])
+WANTMASK = np.array(WANTS + [0], dtype=np.uint64)
+KINGS = np.uint64(sum(1 << c for c in range(KING, 52)))
+ALL = np.uint64((1 << 52) - 1)
+BELOW = np.array([ (1 << c) - 1 for c in range(53) ], dtype=np.uint64)   # BELOW[c]: cards lower than c.
+BIT = np.array([ 1 << c for c in range(52) ], dtype=np.uint64)
+
+######################################################################
+# Returns the highest card in each of the masks (which must not be
+# zero). Masks are below 2**53, so they convert to floats exactly and
+# frexp() gives the position of the top bit.
+def highest(masks):
+    return np.frexp(masks.astype(np.float64))[1] - 1
+
+######################################################################
+# N games in lockstep. The constructor deals the games; run() plays
+# them all out and returns autoplay()-style (winner, turns, left)
+# tuples. Hands are bit masks, which can't hold duplicate cards, so
+# only tables dealt from a single deck can be played.
+#
+# If rng is a random.Random, the games are dealt by deal(), drawing
+# from rng just as autoplay() would, game after game -- which is what
+# makes the results match simulate(), but costs a Python shuffle per
+# game. If rng is a NumPy Generator, all the decks are shuffled at
+# once (as rows of random permutations) and dealt by slicing, giving
+# different (but equally random) games much faster.
+class Batch:
+    def __init__(self, n_games, n_players, rng, piles=4):
+        if decksFor(n_players, piles) > 1:
+            raise ValueError("{} players and {} piles don't fit in one deck".format(n_players, piles))
+        self.N = n_players
+        self.nF = piles
+        if isinstance(rng, np.random.Generator):
+            self.dealArrays(n_games, rng)
+        else:
+            self.dealGames(n_games, rng)
+        self.tails = np.concatenate([self.heads, np.full((n_games, piles), EMPTY, dtype=np.int64)], axis=1)
+        self.ptr = np.zeros(n_games, dtype=np.int64)
+
+        # Pile preference for hand cards, as in MoveGen.target(): corner
+        # j, then foundation j, for j = 0, 1, ...
+        self.order = np.array([ 2*j+1 for j in range(piles) ] + [ 2*j for j in range(piles) ])
+
+    # Deals each game with deal(), exactly as autoplay() does.
+    def dealGames(self, n_games, rng):
+        decks = []
+        hands = []
+        heads = []
+        first = []
+        for g in range(n_games):
+            D, H, F = deal(self.N, createDeck(encoded=True), rng, self.nF)
+            first.append(rng.randint(0, self.N-1))
+            decks.append(list(D))
+            hands.append([ handMask(h) for h in H ])
+            heads.append([ S[0] for S in F ])
+        self.hands = np.array(hands, dtype=np.uint64)
+        self.heads = np.array(heads, dtype=np.int64)
+        self.deck = np.array(decks, dtype=np.int64).reshape(n_games, -1)
+        self.player = np.array(first, dtype=np.int64)
+
+    # Deals all the games at once from a NumPy Generator: hands are the
+    # first HANDSIZE*N cards of each shuffled deck, then come the
+    # foundation cards and the rest of the deck.
+    def dealArrays(self, n_games, rng):
+        N, nF = self.N, self.nF
+        cards = rng.permuted(np.tile(np.arange(52, dtype=np.int64), (n_games, 1)), axis=1)
+        dealt = cards[:, :HANDSIZE*N].reshape(n_games, N, HANDSIZE)
+        self.hands = np.bitwise_or.reduce(BIT[dealt], axis=2)
+        self.heads = cards[:, HANDSIZE*N:HANDSIZE*N+nF].copy()
+        self.deck = cards[:, HANDSIZE*N+nF:].copy()
+        self.player = rng.integers(0, N, n_games)
+
+    # Consolidates the table of each game in g (an index array), as
+    # consolidate() does: while some foundation can move, the lowest
+    # numbered one moves onto the lowest numbered pile that takes it.
+    def consolidate(self, g):
+        nF = self.nF
+        notself = ~np.eye(nF, 2*nF, dtype=bool)
+        while len(g):
+            heads = self.heads[g]                        # (n, nF)
+            tails = self.tails[g]                        # (n, 2nF)
+            fits = FITS[tails[:, None, :], heads[:, :, None]] & notself
+            movable = fits.any(axis=2)                   # (n, nF)
+            some = movable.any(axis=1)
+            g = g[some]
+            if not len(g):
+                break
+            b = movable[some].argmax(axis=1)
+            a = fits[some, b].argmax(axis=1)
+            self.tails[g, a] = self.tails[g, b]
+            self.tails[g, b] = EMPTY
+            self.heads[g, b] = EMPTY
+
+    # Plays one turn, as automove() would, for each game in g. Returns
+    # the number of cards each played.
+    def automove(self, g):
+        nF = self.nF
+        played = np.zeros(len(self.hands), dtype=np.int64)
+        passing = g
+        while len(passing):
+            self.consolidate(passing)
+            cursor = np.full(len(self.hands), EMPTY, dtype=np.int64)
+            placing = passing
+            moved = np.zeros(len(self.hands), dtype=bool)
+            while len(placing):
+                tails = self.tails[placing]
+                hand = self.hands[placing, self.player[placing]]
+                openF = (tails[:, :nF] == EMPTY).any(axis=1)
+                openC = (tails[:, nF:] == EMPTY).any(axis=1)
+                wanted = np.bitwise_or.reduce(WANTMASK[tails], axis=1)
+                wanted = np.where(openC, wanted | KINGS, wanted)
+                wanted = np.where(openF, ALL, wanted)
+                playable = hand & wanted & BELOW[cursor[placing]]
+                some = playable != 0
+                placing = placing[some]
+                if not len(placing):
+                    break
+                card = highest(playable[some])
+                tails = tails[some]
+
+                # Every pile the card may go on; take the preferred one.
+                empty = tails == EMPTY
+                allowed = FITS[tails, card[:, None]]
+                allowed[:, :nF] |= empty[:, :nF]
+                allowed[:, nF:] |= empty[:, nF:] & (card >= KING)[:, None]
+                p = np.where(allowed, self.order, 4*nF).argmin(axis=1)
+
+                self.tails[placing, p] = card
+                isF = p < nF
+                fresh = isF & empty[np.arange(len(p)), p]
+                self.heads[placing[fresh], p[fresh]] = card[fresh]
+                self.hands[placing, self.player[placing]] = hand[some] & ~BIT[card]
+                cursor[placing] = card
+                moved[placing] = True
+                played[placing] += 1
+            passing = passing[moved[passing]]
+        return played
+
+    def run(self):
+        n = len(self.hands)
+        N = self.N
+        L = self.deck.shape[1]
+        turns = np.zeros(n, dtype=np.int64)
+        stalled = np.zeros(n, dtype=np.int64)
+        winner = np.full(n, -1, dtype=np.int64)
+        active = np.arange(n)
+        while len(active):
+            turns[active] += 1
+            player = self.player[active]
+            draw = active[self.ptr[active] < L]
+            self.hands[draw, self.player[draw]] |= BIT[self.deck[draw, self.ptr[draw]]]
+            self.ptr[draw] += 1
+
+            played = self.automove(active)[active]
+            stalled[active] = np.where((played > 0) | (self.ptr[active] < L), 0, stalled[active] + 1)
+            out = self.hands[active, player] == 0
+            winner[active[out]] = player[out]
+            self.player[active] = (player + 1) % N
+            active = active[~out & (stalled[active] < 2*N)]
+
+        if hasattr(np, 'bitwise_count'):      # NumPy 2.0 and later.
+            left = np.bitwise_count(self.hands).tolist()
+        else:
+            left = [ [ bin(int(h)).count('1') for h in row ] for row in self.hands ]
+        return [ (None if w < 0 else w, t, tuple(l)) for w, t, l in zip(winner.tolist(), turns.tolist(), left) ]
+
+######################################################################
+# Batch version of simulate(): plays n_games games between n_players
+# auto players, batch games at a time, and returns the same list of
+# (winner, turns, left) tuples as simulate() with the same arguments.
+# With exact=False, the games are instead dealt by NumPy (see Batch):
+# the results are reproducible from seed, but aren't the games
+# simulate() would play.
+def simulateBatch(n_games, n_players=2, seed=None, piles=4, batch=10000, exact=True):
+    rng = Random(seed) if exact else np.random.default_rng(seed)
+    results = []
+    for start in range(0, n_games, batch):
+        results.extend(Batch(min(batch, n_games-start), n_players, rng, piles).run())
+    return results
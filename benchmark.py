@@ -0,0 +1,165 @@
+######################################################################
+# Benchmark suite for KingsCorner.py. Times the pieces of the engine
+# the simulators lean on hardest -- dealing, legal(), consolidate(),
+# automove() -- plus whole games, and writes the results as JSON so
+# that runs can be compared. Each benchmark is run several times and
+# the best run is kept, which gives steadier numbers than the mean.
+#
+# Usage:
+#   python benchmark.py                      # Print results as JSON.
+#   python benchmark.py -o new.json          # Save them to a file.
+#   python benchmark.py --compare old.json   # Flag regressions.
+#
+import json
+import sys
+from argparse import ArgumentParser
+from platform import python_version
+from random import Random
+from time import perf_counter
+
+from KingsCorner import createDeck, deal, legal, consolidate, automove, simulate, encodeCard
+
+######################################################################
+# Runs fn(arg) for every arg in args, repeat times over, and returns
+# the best rate achieved, in calls per second.
+def rate(fn, args, repeat=5):
+    best = None
+    for r in range(repeat):
+        start = perf_counter()
+        for a in args:
+            fn(a)
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(args)/best
+
+######################################################################
+# Tables for consolidate(). In chain, every foundation can move and
+# each merge enables the next, so consolidate() has the most work to
+# do; in stuck, all eight piles are occupied but nothing can move,
+# which is the most pairs for the old hand-unrolled version to check.
+def chainTable(encoded):
+    F = [ [(12, 'hearts')], [(11, 'spades')], [(10, 'diamonds')], [(9, 'clubs')] ]
+    C = [ [(13, 'clubs')], [], [], [] ]
+    if encoded:
+        F = [ [ encodeCard(c) for c in S ] for S in F ]
+        C = [ [ encodeCard(c) for c in S ] for S in C ]
+    return F, C
+
+def stuckTable(encoded):
+    F = [ [(12, 'hearts')], [(12, 'diamonds')], [(7, 'spades')], [(3, 'clubs')] ]
+    C = [ [(13, 'hearts')], [(13, 'diamonds')], [(13, 'spades')], [(13, 'clubs')] ]
+    if encoded:
+        F = [ [ encodeCard(c) for c in S ] for S in F ]
+        C = [ [ encodeCard(c) for c in S ] for S in C ]
+    return F, C
+
+######################################################################
+# Mid-game (F, C, hand) positions, reached by letting n_players auto
+# players take turns from a fresh deal, for timing automove().
+def positions(n, n_players, encoded, seed):
+    rng = Random(seed)
+    result = []
+    while len(result) < n:
+        D, H, F = deal(n_players, createDeck(encoded=encoded), rng)
+        C = [ [] for i in range(4) ]
+        for turn in range(rng.randint(0, 3)*n_players):
+            hand = H[turn % n_players]
+            if D:
+                hand.append(D.draw())
+            automove(F, C, hand, False)
+        hand = H[0]
+        if D:
+            hand.append(D.draw())
+        result.append((F, C, hand))
+    return result
+
+######################################################################
+# Runs the whole suite; scale multiplies the amount of work done by
+# each benchmark. Returns a dictionary of rates, in calls (or games)
+# per second, keyed by benchmark name.
+def run(scale=1.0, seed=1):
+    results = {}
+    n = max(12, int(5000*scale))
+
+    rng = Random(seed)
+    results['deal'] = rate(lambda a: deal(2, createDeck(), rng), range(n))
+    results['deal.encoded'] = rate(lambda a: deal(2, createDeck(encoded=True), rng), range(n))
+
+    # legal() calls on a mix of pile tops and cards, half of them legal.
+    deck = createDeck()
+    pairs = [ ([deck[rng.randrange(52)]], deck[rng.randrange(52)]) for i in range(4*n) ]
+    pairs = pairs + [ ([(v, 'hearts')], (v-1, 'spades')) for v in range(2, 14) ]*(n//3)
+    results['legal'] = rate(lambda p: legal(p[0], p[1]), pairs)
+    encoded = [ ([encodeCard(S[0])], encodeCard(c)) for S, c in pairs ]
+    results['legal.encoded'] = rate(lambda p: legal(p[0], p[1]), encoded)
+
+    # consolidate() gets a fresh copy of its table each call, so these
+    # rates include copying eight short lists.
+    for name, table in (('chain', chainTable), ('stuck', stuckTable)):
+        for enc in (False, True):
+            F, C = table(enc)
+            fn = lambda a: consolidate([ list(S) for S in F ], [ list(S) for S in C ], False)
+            results['consolidate.{}{}'.format(name, '.encoded' if enc else '')] = rate(fn, range(n))
+
+    # automove() per turn, again on fresh copies.
+    for enc in (False, True):
+        turns = positions(n//5, 2, enc, seed)
+        fn = lambda p: automove([ list(S) for S in p[0] ], [ list(S) for S in p[1] ], list(p[2]), False)
+        results['automove{}'.format('.encoded' if enc else '')] = rate(fn, turns)
+
+    # Whole games. A single deck holds enough cards for at most six
+    # players (7 each, plus the 4 foundations); larger tables are dealt
+    # from a shoe of several decks.
+    for n_players in (2, 4, 6, 8, 16):
+        games = n//25
+        results['games.{}p'.format(n_players)] = rate(lambda a: simulate(games, n_players, seed), range(1), 3)*games
+
+    # The same games on the NumPy batch engine, if NumPy is installed.
+    try:
+        from batch import simulateBatch
+    except ImportError:
+        return results
+    for n_players in (2, 4, 6):
+        games = 2*n
+        results['games.batch.{}p'.format(n_players)] = rate(lambda a: simulateBatch(games, n_players, seed), range(1), 3)*games
+        results['games.batch.fast.{}p'.format(n_players)] = rate(lambda a: simulateBatch(games, n_players, seed, exact=False), range(1), 3)*games
+    return results
+
+######################################################################
+# Compares new results against old ones, printing the ratio new/old
+# for each benchmark present in both. Returns the names of benchmarks
+# that slowed down by more than the given fraction.
+def compare(old, new, slower=0.1):
+    worse = []
+    for name in sorted(new):
+        if name in old:
+            ratio = new[name]/old[name]
+            flag = ''
+            if ratio < 1 - slower:
+                worse.append(name)
+                flag = '  <-- slower'
+            print('{:28} {:14.1f} {:14.1f} {:7.2f}x{}'.format(name, old[name], new[name], ratio, flag), file=sys.stderr)
+    return worse
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark the KingsCorner engine.')
+    parser.add_argument('-o', '--out', help='write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from an earlier run to compare against')
+    parser.add_argument('--slower', type=float, default=0.1, help='slowdown that counts as a regression (default 0.1)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the work done by each benchmark')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    report = { 'python': python_version(), 'scale': args.scale, 'seed': args.seed,
+               'results': run(args.scale, args.seed) }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old['results'], report['results'], args.slower):
+            sys.exit(1)
@@ -0,0 +1,269 @@
+######################################################################
+# Asyncio game server for KingsCorner. One event loop hosts any number
+# of tables at once. Each table is a coroutine running the usual game
+# -- deal(), then turns of drawing and moving until someone goes out
+# -- where human seats are fed moves through a queue by their network
+# connection, and auto players' automove() turns run on a thread pool
+# so that the loop stays free to serve the other tables.
+#
+# The protocol is line-based UTF-8 text. A client opens a table with
+#
+#   NEW <players> [<humans>]   (humans defaults to 1)
+#
+# and takes its first human seat (or, if humans is 0, just watches),
+# or joins one with
+#
+#   JOIN <table>
+#
+# taking its next free human seat (or watching, if there is none).
+# The server answers TABLE <table> SEAT <seat> (seat -1 for watchers)
+# and starts the game once every human seat is taken. Every
+# connection at the table then receives
+#
+#   START <player>                       first player to move
+#   TURN <player> <cards> <deck>         player to move, after drawing
+#   MOVE <player> <src> <dst> <card>     as in an event log
+#   WIN <player>  or  DRAW               end of the game
+#
+# When it's a human's turn, that seat alone gets PILES (each pile as
+# first..last, or -), HAND (the cards in hand) and then GO. The human
+# answers with moves, "src dst", numbered as in usermove(): piles
+# first, then the cards of the last HAND line. Each move is answered
+# with OK (and a fresh PILES, HAND and GO) or ERR <reason>; "/"
+# repeats the state, and "." ends the turn. A human who disconnects is
+# replaced by an auto player.
+#
+# Usage:
+#   python server.py --port 5555
+#
+import asyncio
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+
+from KingsCorner import createShoe, decksFor, deal, automove, makeMove, displayCard, EventLog
+
+######################################################################
+# One table: the game state, plus a move queue and connection for each
+# human seat and a list of watchers' connections.
+class Table:
+    def __init__(self, id, n_players, humans, seed, executor):
+        self.id = id
+        self.rng = Random(seed)
+        self.D, self.H, self.F = deal(n_players, createShoe(decksFor(n_players), encoded=True), self.rng)
+        self.C = [ [] for i in range(len(self.F)) ]
+        self.human = [ i < humans for i in range(n_players) ]
+        self.queues = [ asyncio.Queue() if i < humans else None for i in range(n_players) ]
+        self.writers = [ None for i in range(n_players) ]
+        self.watchers = []
+        self.ready = asyncio.Event()
+        self.done = False
+        self.pending = []         # (seat, line) pairs waiting to be sent.
+        self.executor = executor
+        if humans == 0:
+            self.ready.set()
+
+    # Seats writer at the next free human seat and returns the seat
+    # number, or adds it as a watcher and returns -1.
+    def seat(self, writer):
+        for i in range(len(self.H)):
+            if self.human[i] and self.writers[i] is None and not self.ready.is_set():
+                self.writers[i] = writer
+                self.checkReady()
+                return i
+        self.watchers.append(writer)
+        return -1
+
+    # Called when the connection for seat goes away.
+    def leave(self, seat, writer):
+        if seat < 0:
+            self.watchers.remove(writer)
+        elif self.writers[seat] is writer:
+            self.writers[seat] = None
+            self.human[seat] = False
+            self.queues[seat].put_nowait('.')
+            self.checkReady()
+
+    # Starts the game once every human seat is taken.
+    def checkReady(self):
+        if all(w is not None for h, w in zip(self.human, self.writers) if h):
+            self.ready.set()
+
+    # Queues a line for seat, or for everybody at the table. Lines are
+    # sent by flush(), one write per connection, before the table next
+    # waits for anything.
+    def send(self, line, seat=None):
+        self.pending.append((seat, line))
+
+    def flush(self):
+        if not self.pending:
+            return
+        everyone = '\n'.join(line for seat, line in self.pending if seat is None)
+        for i, writer in enumerate(self.writers):
+            if writer is not None:
+                lines = [ line for seat, line in self.pending if seat is None or seat == i ]
+                if lines:
+                    writer.write(('\n'.join(lines) + '\n').encode())
+        if everyone:
+            for writer in self.watchers:
+                writer.write((everyone + '\n').encode())
+        self.pending = []
+
+    # Sends MOVE lines for the events recorded in log, then empties it.
+    def report(self, log):
+        for player, src, dst, card in log:
+            self.send('MOVE {} {} {} {}'.format(player, src, dst, displayCard(card)))
+        log.clear()
+
+    def showState(self, player):
+        piles = [ displayCard(S[0]) + '..' + displayCard(S[-1]) if S else '-' for S in self.F + self.C ]
+        self.send('PILES ' + ' '.join(piles), player)
+        self.send('HAND ' + ' '.join(displayCard(c) for c in self.H[player]), player)
+        self.send('GO', player)
+
+    async def humanTurn(self, player, log):
+        hand = self.H[player]
+        hand.sort(reverse=True)
+        self.showState(player)
+        queue = self.queues[player]
+        while hand:
+            self.flush()
+            line = await queue.get()
+            if line == '.':
+                break
+            if line == '/':
+                self.showState(player)
+                continue
+            try:
+                src, dst = [ int(x) for x in line.split() ]
+                makeMove(self.F, self.C, hand, src, dst, log)
+            except ValueError as e:
+                self.send('ERR {}'.format(e), player)
+                continue
+            self.send('OK', player)
+            self.report(log)
+            if hand:
+                self.showState(player)
+
+    async def autoTurn(self, player, log):
+        if self.executor is None:
+            automove(self.F, self.C, self.H[player], log)
+        else:
+            self.flush()
+            await asyncio.get_running_loop().run_in_executor(self.executor, automove, self.F, self.C, self.H[player], log)
+        self.report(log)
+
+    # Plays the game, ending it (as autoplay() does) when a player goes
+    # out or nobody can move for two full rounds with the deck empty.
+    async def run(self):
+        await self.ready.wait()
+        D, H = self.D, self.H
+        N = len(H)
+        log = EventLog(256)
+        player = self.rng.randint(0, N-1)
+        self.send('START {}'.format(player))
+        stalled = 0
+        while stalled < 2*N:
+            if D:
+                H[player].append(D.draw())
+            self.send('TURN {} {} {}'.format(player, len(H[player]), len(D)))
+            before = len(H[player])
+            log.player = player
+            if self.human[player]:
+                await self.humanTurn(player, log)
+            else:
+                await self.autoTurn(player, log)
+            if len(H[player]) < before or D:
+                stalled = 0
+            else:
+                stalled = stalled + 1
+            if H[player] == []:
+                self.send('WIN {}'.format(player))
+                break
+            player = (player + 1) % N
+            if self.executor is None:
+                self.flush()
+                await asyncio.sleep(0)    # Let the other tables have a go.
+        else:
+            self.send('DRAW')
+        self.flush()
+        self.done = True
+        for writer in self.writers + self.watchers:
+            if writer is not None:
+                writer.close()
+
+######################################################################
+# The server: accepts connections and runs the tables. Table seeds are
+# drawn from seed, so a server given a seed deals the same games in
+# the same order. Tables of more than six players are dealt from a
+# shoe of several decks. If offload is False, auto players run on the
+# event loop itself, which is faster when automove() is quick and
+# there is little else for the loop to do.
+class Server:
+    def __init__(self, seed=None, offload=True, max_players=16):
+        self.rng = Random(seed)
+        self.tables = {}
+        self.tasks = set()
+        self.next = 0
+        self.max_players = max_players
+        self.executor = ThreadPoolExecutor() if offload else None
+
+    def newTable(self, n_players, humans):
+        table = Table(self.next, n_players, humans, self.rng.getrandbits(64), self.executor)
+        self.tables[table.id] = table
+        self.next = self.next + 1
+        task = asyncio.get_running_loop().create_task(table.run())
+        self.tasks.add(task)
+        task.add_done_callback(lambda t: (self.tasks.discard(t), self.tables.pop(table.id, None)))
+        return table
+
+    async def handle(self, reader, writer):
+        words = (await reader.readline()).decode().split()
+        try:
+            if words[0] == 'NEW':
+                n_players = int(words[1])
+                humans = int(words[2]) if len(words) > 2 else 1
+                if not 2 <= n_players <= self.max_players or not 0 <= humans <= n_players:
+                    raise ValueError
+                table = None
+            elif words[0] == 'JOIN':
+                table = self.tables[int(words[1])]
+            else:
+                raise ValueError
+        except (IndexError, KeyError, ValueError):
+            writer.write('ERR expected NEW <players> [<humans>] or JOIN <table>\n'.encode())
+            writer.close()
+            return
+        # Made outside the try, so that a failure here isn't taken for
+        # a bad request.
+        if table is None:
+            table = self.newTable(n_players, humans)
+
+        seat = table.seat(writer)
+        writer.write('TABLE {} SEAT {}\n'.format(table.id, seat).encode())
+        try:
+            async for line in reader:
+                if seat >= 0 and not table.done:
+                    table.queues[seat].put_nowait(line.decode().strip())
+        except ConnectionError:
+            pass
+        finally:
+            table.leave(seat, writer)
+
+    async def start(self, host='127.0.0.1', port=0):
+        return await asyncio.start_server(self.handle, host, port)
+
+async def main(host, port, seed, offload):
+    server = await Server(seed, offload).start(host, port)
+    print('Serving on {}'.format(', '.join(str(s.getsockname()) for s in server.sockets)))
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Host KingsCorner tables.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--inline', action='store_true', help='run auto players on the event loop')
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.seed, not args.inline))
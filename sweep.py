@@ -0,0 +1,178 @@
+######################################################################
+# Parallel parameter sweep for the auto player. Every combination of
+# the autopolicy() options in the grid (KingsCorner.POLICY by default)
+# is a candidate, and candidates play each other head to head in
+# rounds, across a process pool, until one is left or the rounds run
+# out. Each round seats the surviving candidates at random tables of
+# n_players; every table plays the same games once per rotation of its
+# seats (so each candidate gets each deal from each seat), and a
+# candidate's score is its win rate over all the seats it has played.
+#
+# After each round, candidates are raced: any whose win rate is
+# clearly below the leader's -- its upper confidence bound, z
+# standard errors above its rate, is below the leader's lower bound --
+# is dropped, so later rounds spend their games on the contenders.
+# With halve=True, only the better half of the survivors is kept as
+# well (successive halving), which finishes sooner but can drop a
+# candidate on noise.
+#
+# Every table's result, and each round's standings, are appended to a
+# JSONL file as they come in (see Store), so a long sweep can be
+# inspected while it runs.
+#
+# Usage:
+#   python sweep.py                              # The full POLICY grid.
+#   python sweep.py --players 3 --rounds 6 -o sweep.jsonl
+#   python sweep.py --param kings=corner,last --halve
+#
+import json
+from argparse import ArgumentParser
+from functools import partial
+from itertools import product
+from math import sqrt
+from multiprocessing import Pool
+
+from KingsCorner import autopolicy, simulate, Stream, POLICY
+
+######################################################################
+# A JSONL file of results: append() writes one record (a dictionary)
+# per line, flushing it at once, and load() reads them all back.
+class Store:
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return [ json.loads(line) for line in f if line.strip() ]
+        except FileNotFoundError:
+            return []
+
+# Returns the list of candidate configurations, as dictionaries, for
+# a grid giving each option's choices.
+def candidates(grid):
+    names = sorted(grid)
+    return [ dict(zip(names, values)) for values in product(*(grid[n] for n in names)) ]
+
+def name(config):
+    return ','.join('{}={}'.format(k, config[k]) for k in sorted(config))
+
+######################################################################
+# Plays one table; this is what each pool worker runs. The input is a
+# (configs, n_games, seed) tuple, with one configuration per seat, and
+# the output is a (wins, seats) pair of lists, counting for each seat
+# the games it won and played. The same n_games deals (game g dealt
+# from Stream(seed, g)) are played with the seats rotated each way.
+def _table(job):
+    configs, n_games, seed = job
+    N = len(configs)
+    strategies = [ partial(autopolicy, **c) for c in configs ]
+    wins = [0]*N
+    for r in range(N):
+        seats = [ (i + r) % N for i in range(N) ]
+        for winner, turns, left in simulate(n_games, N, seed, strategy=[ strategies[i] for i in seats ], streams=True):
+            if winner is not None:
+                wins[seats[winner]] = wins[seats[winner]] + 1
+    return wins, [N*n_games]*N
+
+######################################################################
+# Runs the sweep and returns the standings of the candidates still in
+# the race, best first, as a list of (config, wins, games) tuples.
+# grid maps option names to lists of choices, n_games is the number of
+# deals per table, and each round seats every survivor at about tables
+# tables. Results are appended to store, if given.
+def sweep(grid=POLICY, n_players=2, n_games=50, tables=4, rounds=8, z=2.0, halve=False,
+          seed=None, workers=None, store=None):
+    rng = Stream(seed)
+    alive = [ name(c) for c in candidates(grid) ]
+    configs = { name(c): c for c in candidates(grid) }
+    wins = dict.fromkeys(alive, 0)
+    games = dict.fromkeys(alive, 0)
+
+    def standings():
+        return sorted(alive, key=lambda k: -wins[k]/games[k] if games[k] else 0.0)
+
+    with Pool(workers) as pool:
+        for r in range(rounds):
+            if len(alive) < 2:
+                break
+            # Seat everyone about tables times, filling each last table
+            # with randomly chosen survivors not already at it.
+            seating = []
+            for t in range(tables):
+                order = list(alive)
+                rng.shuffle(order)
+                while len(order) % n_players:
+                    table = order[len(order) - len(order) % n_players:]
+                    others = [ k for k in alive if k not in table ]
+                    order.append(rng.choice(others or alive))
+                seating.extend(order)
+            jobs = []
+            for i in range(0, len(seating), n_players):
+                seats = seating[i:i+n_players]
+                jobs.append(([ configs[k] for k in seats ], n_games, rng.getrandbits(64)))
+
+            # A candidate seated more than once at a table (only when
+            # fewer survive than there are seats) is playing itself, so
+            # those seats don't count.
+            for (seats, n, s), (w, g) in zip(jobs, pool.imap(_table, jobs)):
+                names = [ name(c) for c in seats ]
+                for k, wc, gc in zip(names, w, g):
+                    if names.count(k) == 1:
+                        wins[k] = wins[k] + wc
+                        games[k] = games[k] + gc
+                if store is not None:
+                    store.append({ 'round': r, 'seed': s, 'games': n,
+                                   'seats': [ name(c) for c in seats ], 'wins': w })
+
+            # Race: drop anyone whose upper bound is below the leader's
+            # lower bound. Anyone with no games counted yet stays in.
+            bounds = {}
+            for k in alive:
+                if not games[k]:
+                    bounds[k] = (0.0, 1.0)
+                    continue
+                p = wins[k]/games[k]
+                se = sqrt(max(p*(1-p), 1e-9)/games[k])
+                bounds[k] = (p - z*se, p + z*se)
+            best = max(lo for lo, hi in bounds.values())
+            alive = [ k for k in alive if bounds[k][1] >= best ]
+            if halve and len(alive) > 2:
+                alive = standings()[:(len(alive)+1)//2]
+            if store is not None:
+                store.append({ 'round': r, 'alive': standings(),
+                               'rates': { k: wins[k]/games[k] if games[k] else 0.0 for k in alive } })
+
+    return [ (configs[k], wins[k], games[k]) for k in standings() ]
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Sweep auto player policies against each other.')
+    parser.add_argument('-o', '--out', default='sweep.jsonl', help='JSONL file to append results to (default sweep.jsonl)')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=A,B',
+                        help='choices for one option (default: all of POLICY)')
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--games', type=int, default=50, help='deals per table (default 50)')
+    parser.add_argument('--tables', type=int, default=4, help='tables per candidate per round (default 4)')
+    parser.add_argument('--rounds', type=int, default=8)
+    parser.add_argument('--z', type=float, default=2.0, help='confidence bound width, in standard errors (default 2)')
+    parser.add_argument('--halve', action='store_true', help='also keep only the better half each round')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    grid = dict(POLICY)
+    for p in args.param:
+        option, _, choices = p.partition('=')
+        choices = choices.split(',')
+        if option not in POLICY or not set(choices) <= set(POLICY[option]):
+            parser.error('bad --param {}: choices are {}'.format(p, POLICY))
+        grid[option] = choices
+
+    results = sweep(grid, args.players, args.games, args.tables, args.rounds, args.z, args.halve,
+                    args.seed, args.workers, Store(args.out))
+    for config, w, g in results:
+        print('{:50} {:8} {:8} {:7.3f}'.format(name(config), w, g, w/g if g else 0.0))
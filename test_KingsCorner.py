@@ -0,0 +1,233 @@
+######################################################################
+# Invariants the faster code paths must keep: each gives exactly the
+# same games as the plain list-based engine. Run with pytest.
+#
+import copy
+import io
+from functools import partial
+from random import Random
+
+import pytest
+
+from KingsCorner import (automove, autopolicy, autoplay, consolidate, createDeck, createShoe, deal, decksFor,
+                         playout, recordGames, simulate, ConsolidateCache, Deck, EventLog, GameFile,
+                         GameState, Pile, PositionHash, Stream, Tee, DECK, HAND, HANDSIZE, MAXPILES, PASS)
+
+######################################################################
+# Cached consolidation gives the same games, and leaves the same
+# piles, as consolidate().
+def test_cache_matches_consolidate():
+    cache = ConsolidateCache(1000)
+    assert simulate(300, 3, seed=5, strategy=partial(automove, merge=cache)) == simulate(300, 3, seed=5)
+    assert cache.hits > 0
+    for seed in range(50):
+        D, H, F = deal(2, createDeck(encoded=True), Random(seed))
+        C = [ [H[0].pop()], [], [], [] ]
+        F2 = [ list(S) for S in F ]
+        C2 = [ list(S) for S in C ]
+        assert cache(F, C, None) == consolidate(F2, C2, None)
+        assert (F, C) == (F2, C2)
+
+######################################################################
+# The batch engine plays the same games as simulate(), in its exact
+# mode; skipped without NumPy.
+def test_batch_matches_simulate():
+    batch = pytest.importorskip('batch')
+    for n_players in (2, 3, 4):
+        assert batch.simulateBatch(300, n_players, seed=7) == simulate(300, n_players, seed=7)
+
+######################################################################
+# A PositionHash kept up to date move by move, as a game's log, always
+# equals one computed afresh from the position.
+class HashCheck:
+    def __init__(self, h, F, C, H, D):
+        self.h = h
+        self.table = (F, C, H, D)
+        self.checked = 0
+
+    def turn(self, player, card=None):
+        F, C, H, D = self.table
+        fresh = PositionHash(F, C, H, D, player)
+        assert (self.h.exact(), self.h.value()) == (fresh.exact(), fresh.value())
+        self.checked = self.checked + 1
+
+    def move(self, src, dst, card):
+        pass
+
+def test_position_hash_incremental():
+    for seed in range(20):
+        D, H, F = deal(3, createDeck(encoded=True), Random(seed))
+        C = [ [] for i in range(4) ]
+        h = PositionHash(F, C, H, D)
+        check = HashCheck(h, F, C, H, D)
+        playout(D, H, F, C, 0, automove, Tee(h, check))
+        assert check.checked > 0
+
+######################################################################
+# Piles, with or without history, give the same games as lists, and
+# index like them at the ends.
+def test_piles_match_lists():
+    expected = simulate(300, 3, seed=5)
+    assert simulate(300, 3, seed=5, pile=Pile) == expected
+    assert simulate(300, 3, seed=5, pile=partial(Pile, history=True)) == expected
+
+def test_pile_indexing():
+    for history in (False, True):
+        for i in (0, -1):
+            with pytest.raises(IndexError):
+                Pile(history=history)[i]
+        S = Pile([51, 46, 40], history)
+        assert (S[0], S[-1], S[2], S[-3], len(S)) == (51, 40, 40, 51, 3)
+    assert Pile([51, 46, 40], history=True)[1] == 46
+    with pytest.raises(IndexError):
+        Pile([51, 46, 40])[1]
+
+######################################################################
+# autopolicy() with its default options is automove().
+def test_autopolicy_defaults_match_automove():
+    assert simulate(300, 3, seed=3, strategy=autopolicy) == simulate(300, 3, seed=3)
+
+######################################################################
+# Large tables: decksFor() gives a shoe that deals any table, and pile
+# numbers that don't fit in a binary event are refused.
+def test_shoe_deals_every_table():
+    for N in range(2, 17):
+        for piles in (1, 4, 6, 8, 20, 40):
+            decks = decksFor(N, piles)
+            D, H, F = deal(N, createShoe(decks, encoded=True), Random(N), piles)
+            assert [ len(h) for h in H ] == [HANDSIZE]*N and len(F) == piles
+            assert len(D) == 52*decks - HANDSIZE*N - piles
+            if decks > 1:
+                with pytest.raises(IndexError):
+                    deal(N, createShoe(decks-1, encoded=True), Random(N), piles)
+    assert len(simulate(3, 14)) == 3
+    assert len(simulate(5, 2, piles=20)) == 5
+
+def test_pile_numbers_fit_events():
+    with pytest.raises(ValueError):
+        recordGames(io.BytesIO(), 1, 2, piles=MAXPILES+1)
+    log = EventLog()
+    log.move(HAND, HAND, 5)
+    with pytest.raises(ValueError):
+        log.flush(io.BytesIO())
+
+######################################################################
+# GameState: random sequences of apply(), undo() and fork() on several
+# live states. After every step, each state must match a plain model
+# of its position (kept as a stack of snapshots, one per move), and
+# the lists the first state was made from must be untouched.
+def snapshot(s):
+    return ([ list(S) for S in s.F ], [ list(S) for S in s.C ], [ list(h) for h in s.H ], s.top, s.player)
+
+def modelApply(snap, move, D):
+    F, C, H, top, player = copy.deepcopy(snap)
+    src, dst, card = move
+    if src == DECK:
+        H[player].append(D[top])
+        top = top + 1
+    elif move == PASS:
+        player = (player + 1) % len(H)
+    else:
+        S = F[dst] if dst < len(F) else C[dst-len(F)]
+        if src == HAND:
+            H[player].remove(card)
+            S.append(card)
+        else:
+            S.extend(F[src])
+            F[src] = []
+    return (F, C, H, top, player)
+
+def test_game_state_apply_undo_fork():
+    for seed in range(30):
+        rng = Random(seed)
+        D, H, F = deal(2, createDeck(encoded=True), rng)
+        D = list(D)
+        C = [ [] for i in range(4) ]
+        original = copy.deepcopy((F, C, H, D))
+        states = [ (GameState(F, C, H, D), [ snapshot(GameState(F, C, H, D)) ]) ]
+        for step in range(300):
+            s, stack = rng.choice(states)
+            r = rng.random()
+            if r < 0.1 and len(states) < 6:
+                t = s.fork()
+                states.append((t, [ snapshot(t) ]))
+            elif r < 0.4 and len(stack) > 1:
+                s.undo()
+                stack.pop()
+            else:
+                moves = s.moves() + [PASS]
+                if s.top < len(D):
+                    moves.append((DECK, HAND, D[s.top]))
+                move = rng.choice(moves)
+                s.apply(move)
+                stack.append(modelApply(stack[-1], move, D))
+            for t, history in states:
+                assert snapshot(t) == history[-1]
+            assert (F, C, H, D) == original
+        # Illegal moves are refused, leaving the state as it was.
+        s, stack = states[0]
+        with pytest.raises(ValueError):
+            s.apply((HAND, 99, 0))
+        assert snapshot(s) == stack[-1]
+
+######################################################################
+# Game records: replaying a recorded game rebuilds the position the
+# game itself reached, on one-deck and multi-deck tables.
+def test_records_replay(tmp_path):
+    for N, piles, seed in ((2, 4, 1), (3, 6, 2), (8, 4, 3)):
+        path = tmp_path / 'games{}.kcg'.format(N)
+        with open(path, 'wb') as f:
+            results = recordGames(f, 20, N, seed, piles)
+        assert results == simulate(20, N, seed, piles)
+
+        games = GameFile(str(path))
+        rng = Random(seed)
+        decks = decksFor(N, piles)
+        for rec, result in zip(games, results):
+            D, H, F = deal(N, createShoe(decks, encoded=True), rng, piles)
+            C = [ [] for i in range(piles) ]
+            first = rng.randint(0, N-1)
+            assert list(rec.deal()) == [ c for h in H for c in h ] + [ S[0] for S in F ] + list(D)
+            assert playout(D, H, F, C, first) == result
+            assert (rec.players, rec.piles, rec.first, rec.decks) == (N, piles, first, decks)
+            assert (rec.winner, rec.turns) == result[:2]
+            D2, H2, F2, C2 = rec.replay()
+            assert (list(D2), F2, C2) == (list(D), F, C)
+            assert [ sorted(h) for h in H2 ] == [ sorted(h) for h in H ]
+        del rec
+        games.close()
+
+######################################################################
+# Streams and decks: jump(n) skips exactly n outputs, each game of a
+# streams=True batch can be replayed alone, and deal() deals exactly
+# as the original pop-based dealing did.
+def test_stream_jump():
+    for n in (0, 1, 2, 7, 1000):
+        a = Stream(42, 7)
+        b = Stream(42, 7)
+        a.jump(n)
+        for i in range(n):
+            b._next()
+        assert a.getstate() == b.getstate()
+        assert [ a.random() for i in range(5) ] == [ b.random() for i in range(5) ]
+
+def test_streams_replay_alone():
+    for N in (2, 3, 5):
+        results = simulate(30, N, seed=9, streams=True)
+        assert [ autoplay(N, Stream(9, g)) for g in range(30) ] == results
+
+def popDeal(N, D, rng, piles):
+    rng.shuffle(D)
+    H = [ [ D.pop(i) for i in range(HANDSIZE) ] for person in range(N) ]
+    F = [ [D.pop(i)] for i in range(piles) ]
+    return D, H, F
+
+def test_deal_matches_pop_dealing():
+    for N, piles in ((2, 4), (4, 4), (6, 4), (3, 6), (9, 8)):
+        shoe = createShoe(decksFor(N, piles), encoded=True)
+        for seed in range(10):
+            D, H, F = deal(N, list(shoe), Random(seed), piles)
+            D2, H2, F2 = popDeal(N, list(shoe), Random(seed), piles)
+            assert (list(D), H, F) == (D2, H2, F2)
+    D = Deck([12, 40, 7])
+    assert [ D.draw() for i in range(3) ] == [12, 40, 7] and len(D) == 0